@@ -1,24 +1,36 @@
 import logging
+import math
 import os
 import socket
 import sys
 import threading
-import time
 import tkinter as tk
+from contextlib import nullcontext
 from datetime import datetime
+from functools import partial
 from logging.handlers import RotatingFileHandler
 from tkinter import filedialog, messagebox, scrolledtext
-from types import NoneType
-from typing import Iterable
 
 import pandas as pd
-import pyvisa
 import ttkbootstrap as ttk
 
+from libraries.async_engine import AsyncSequenceEngine
 from libraries.Chamber import ACS_Discovery1200
-from libraries.Connection import Charger
-from libraries.infer_data import get_data
+from libraries.clock import Clock, ClockEvent, ScaledClock, VirtualClock
+from libraries.connection_manager import connect_all, summary
+from libraries.Connection import Charger, ChargerGroup
+from libraries.infer_data import check_stream, get_data, stream_sequence
 from libraries.other_SCPI import CHROMA, HP6032A, ITECH, MSO58B
+from libraries.plan import (compile_plan, iter_plan, split_lanes,
+                             sync_parties)
+from libraries.ramp import RampEngine, use_engine
+from libraries.scheduler import DeadlineScheduler, SequenceAborted
+from libraries.simulation import (MODELS, AresModel, ChamberModel,
+                                  SimulatedACS_Discovery1200,
+                                  SimulatedCharger, SimulatedChargerGroup,
+                                  ares_models, install_visa)
+from libraries.telemetry import Sampler
+from libraries.telemetry_log import TelemetryLog
 
 ###############################
 # ----- LOGGING OPTIONS ----- #
@@ -75,6 +87,27 @@ ARM_XL_ADDRESS = {"host": "192.168.0.103",
                   "pwd": "ABB"}
 
 FILENAME = "command.xlsx"
+ASYNC_ENGINE = False  # steps, ramps and telemetry on one asyncio loop
+SIMULATION = False  # dry run on simulated instruments, no hardware needed
+# rehearsal on the simulated instruments: None real time, 1000 runs 1000
+# times faster, math.inf as fast as possible
+VIRTUAL_CLOCK: float | None = None
+VISA_PREFIX = ("ASRL", "GPIB", "PXI", "visa", "TCPIP", "USB", "VXI")
+CONNECTION_TIMEOUT = {  # seconds
+    "ITECH": 10,
+    "CHROMA": 10,
+    "HP6032A": 10,
+    "MSO58B": 10,
+    "CHAMBER": 10,
+    "ARM_XL": 10,
+}
+TELEMETRY_DIR = f"{os.path.dirname(os.path.abspath(__file__))}/telemetry"
+SAMPLE_PERIOD = {  # seconds between two measures, 0 to disable
+    "ITECH": 1,
+    "CHROMA": 5,
+    "HP6032A": 1,
+    "CHAMBER": 10,
+}
 
 
 ###################################
@@ -128,7 +161,7 @@ class ShowInfo(tk.Toplevel):
                                    text="  PAUSE  ",
                                    font=("ABBvoice", "20"),
                                    command=self.pause)
-        self.skip_btn.grid(row=6, column=0, padx=10, pady=10)
+        self.pause_btn.grid(row=6, column=0, padx=10, pady=10)
 
         self.all_command = scrolledtext.ScrolledText(main_frm,
                                                      height=11, width=65)
@@ -142,7 +175,7 @@ class ShowInfo(tk.Toplevel):
         _logger.info("Skipping...")
         self.skip_btn.grid_forget()
         self.update()
-        self.after(1000, self.skip_btn.grid(
+        self.after(1000, lambda: self.skip_btn.grid(
             row=5, column=0, padx=10, pady=10
             ))
 
@@ -153,12 +186,14 @@ class ShowInfo(tk.Toplevel):
             self.skip_btn.configure(state="normal")
             self.pause_btn.configure(text="  PAUSE  ")
             self.update()
+            self.pause_state = False
         else:
             self.play_event.clear()
             _logger.info("Pausing...")
             self.skip_btn.configure(state="disabled")
             self.pause_btn.configure(text="  RESUME  ")
             self.update()
+            self.pause_state = True
 
     def update_text(self, instr: str, command: str, time_: str, index: int):
         self.index_lbl.configure(text=str(index))
@@ -221,7 +256,9 @@ class User_Options(ttk.Window):
             filetypes=[
                 ("Tutti i file", "*.*"),
                 ("Sequenza Comandi", "*.xlsx"),
-                # ("File di configigurazione", "*.json"),
+                ("Sequenza Comandi CSV", "*.csv"),
+                ("Sequenza JSON", "*.json"),
+                ("Sequenza JSON Lines (streaming)", "*.jsonl"),
                 ("Tutti i File Excel", "*.xl*"),
                 ],
             )
@@ -265,42 +302,16 @@ class User_Options(ttk.Window):
         check.configure(command=lambda wds=ent_l, var=self.bool_var["ARM_XL"]:  on_off(var, wds))
 
 
-def arg_parse(arg_str):
-    """Parsing argument from str type"""
-    import ast
-    if isinstance(arg_str, pd._libs.missing.NAType | NoneType):
-        return None
-    elif arg_str == "":
-        return None
-    elif arg_str == "-":
-        return None
-    elif isinstance(arg_str, int) or isinstance(arg_str, float):
-        return [arg_str]
-    else:
-        "".split()
-        args = [i.split() if len(i.split()) > 1 else i
-                for i in arg_str.split()]
-
-    def tryeval(val):
-        if isinstance(val, Iterable) and not isinstance(val, str):
-            val = [tryeval(i) for i in val]
-        try:
-            val = ast.literal_eval(val)
-        except ValueError:
-            pass
-        return val
-
-    args = [tryeval(i) for i in args]
-    return args
-
-
-def parse_command(command: str, args: str):
-    """Parse command for ARMxl"""
-    if not isinstance(args, str):
-        args = str(args)
-    base_cmd = "nohup ./"
-    cmd = base_cmd + command + " " + args + " & >/dev/null\n"
-    return cmd
+def connect_visa(cls, address: str, configure: bool = False):
+    """Connect a SCPI instrument, raising if not possible"""
+    instr = cls()
+    connected, error = instr.connect(address)
+    if not connected:
+        raise error
+    if configure:
+        instr.config()
+    return instr
+
 
 #################################
 # ----- # USER OPTIONS #  ----- #
@@ -310,75 +321,95 @@ root.mainloop()
 usage_cfg = root.bool_var
 string_cfg = root.string_var
 # TODO add you sure?
-rm = pyvisa.ResourceManager()
 
 
 ########################
 # ----- GET DATA ----- #
 ########################
-_logger.debug("Getting data, check new sequence, add basic sequence")
-df, list_of_time, list_of_instr, list_of_command, list_of_args = get_data(filename=FILENAME, logger=_logger)  # noqa: E501
-lenght = df.__len__()
+filename = root.filename.get()
+if filename.endswith(".jsonl"):  # long generated campaign, streamed
+    _logger.debug(f"Checking streamed sequence {filename}")
+    check_stream(filename, _logger)  # whole file, before connecting
+    _logger.debug(f"Streaming sequence from {filename}")
+    df = None
+else:
+    _logger.debug("Getting data, check new sequence, add basic sequence")
+    df = get_data(filename=filename, logger=_logger)
 
 ##########################
 # ----- Connecting ----- #
 ##########################
 _logger.debug("Connecting all item...")
-try:
-    # ITECH
-    address = string_cfg["ITECH"].get()
-    if address.startswith(("ASRL", "GPIB", "PXI", "visa", "TCPIP", "USB", "VXI")) and usage_cfg["ITECH"].get() is True:  # noqa: E501
-        itech = ITECH()
-        itech.connect(address)
-        itech.config()
-    else:
-        itech = None
-    # CHROMA
-    address = string_cfg["CHROMA"].get()
-    if address.startswith(("ASRL", "GPIB", "PXI", "visa", "TCPIP", "USB", "VXI")) and usage_cfg["CHROMA"].get() is True:  # noqa: E501
-        chroma = CHROMA()
-        chroma.connect(address)
-    else:
-        chroma = None
-    # HP6032A
-    address = string_cfg["HP6032A"].get()
-    if address.startswith(("ASRL", "GPIB", "PXI", "visa", "TCPIP", "USB", "VXI")) and usage_cfg["HP6032A"].get() is True:  # noqa: E501
-        hp6032a = HP6032A()
-        hp6032a.connect(address)
+if SIMULATION and VIRTUAL_CLOCK is not None:
+    _logger.warning(f"SIMULATION: virtual clock, {VIRTUAL_CLOCK}x real time")
+    clock = (VirtualClock() if math.isinf(VIRTUAL_CLOCK)
+             else ScaledClock(VIRTUAL_CLOCK))
+    use_engine(RampEngine(clock))
+else:
+    clock = Clock()
+if SIMULATION:
+    _logger.warning("SIMULATION: instruments are not connected")
+    install_visa({string_cfg[name].get(): model(clock.monotonic)
+                  for name, model in MODELS.items()})
+    chamber_cls = partial(SimulatedACS_Discovery1200,
+                          model=ChamberModel(clock.monotonic))
+    for host in string_cfg["ARM_XL"]["host"].get().split(","):
+        ares_models[host.strip()] = AresModel(f"armxl-{host.strip()}",
+                                              clock.monotonic)
+    charger_cls, group_cls = SimulatedCharger, SimulatedChargerGroup
+else:
+    chamber_cls = ACS_Discovery1200
+    charger_cls, group_cls = Charger, ChargerGroup
+factories = {}
+for name, cls in (("ITECH", ITECH), ("CHROMA", CHROMA),
+                  ("HP6032A", HP6032A), ("MSO58B", MSO58B)):
+    address = string_cfg[name].get()
+    if address.startswith(VISA_PREFIX) and usage_cfg[name].get() is True:
+        factories[name] = partial(connect_visa, cls, address,
+                                  configure=(name == "ITECH"))
+com_port = string_cfg["CHAMBER"].get()
+if com_port.startswith(("COM", "tty")) and usage_cfg["CHAMBER"].get() is True:  # noqa: E501
+    factories["CHAMBER"] = partial(chamber_cls, com_port)
+if usage_cfg["ARM_XL"].get() is True:
+    # more ARMxl: host separated by comma, commands sent to all
+    hosts = [h.strip() for h in string_cfg["ARM_XL"]["host"].get().split(",")]
+    try:
+        for host in hosts:
+            socket.inet_aton(host)
+    except socket.error as e:
+        _logger.exception("SSH connection Error")
+        raise e
+    if len(hosts) > 1:
+        factories["ARM_XL"] = partial(group_cls, hosts,
+                                      user=string_cfg["ARM_XL"]["user"].get(),
+                                      pwd=string_cfg["ARM_XL"]["pwd"].get(),
+                                      timeout=CONNECTION_TIMEOUT["ARM_XL"])
     else:
-        hp6032a = None
-    # MSO58B
-    address = string_cfg["MSO58B"].get()
-    if address.startswith(("ASRL", "GPIB", "PXI", "visa", "TCPIP", "USB", "VXI")) and usage_cfg["MSO58B"].get() is True:  # noqa: E501
-        mso58b = MSO58B()
-        mso58b.connect(address)
-    else:
-        mso58b = None
-    # CHAMBER
-    com_port = string_cfg["CHAMBER"].get()
-    if com_port.startswith(("COM", "tty")) and usage_cfg["CHAMBER"].get() is True:  # noqa: E501
-        chamber = ACS_Discovery1200(com_port)
-    else:
-        chamber = None
-    # ARM-XL
-    if usage_cfg["ARM_XL"].get() is True:
-        host = string_cfg["ARM_XL"]["host"].get()
-        socket.inet_aton(host)
-        user = string_cfg["ARM_XL"]["user"].get()
-        pwd = string_cfg["ARM_XL"]["pwd"].get()
-        arm_xl = Charger(host=host,
-                         user=user,
-                         pwd=pwd)
-    else:
-        arm_xl = None
-except socket.error as e:
-    _logger.exception("SSH connection Error")
-    raise e
-except Exception as e:
-    _logger.exception("Connection Error")
-    raise e
+        factories["ARM_XL"] = partial(charger_cls,
+                                      host=hosts[0],
+                                      user=string_cfg["ARM_XL"]["user"].get(),
+                                      pwd=string_cfg["ARM_XL"]["pwd"].get())
+
+connected = connect_all(factories, CONNECTION_TIMEOUT)
+if not all(result.connected for result in connected.values()):
+    _logger.error("Connection Error")
+    messagebox.showerror("Connection Error", summary(connected))
+    raise ConnectionError("Instrument not connected")
+itech, chroma, hp6032a, mso58b, chamber, arm_xl = (
+    connected[name].instrument if name in connected else None
+    for name in ("ITECH", "CHROMA", "HP6032A", "MSO58B", "CHAMBER", "ARM_XL")
+    )
 
 _logger.info("All items connected")
+sampler = Sampler(clock=clock)
+telemetry_log = TelemetryLog(
+    f"{TELEMETRY_DIR}/{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+for name, period in SAMPLE_PERIOD.items():
+    if period and name in connected:
+        channel = sampler.add_instrument(name, connected[name].instrument,
+                                         period)
+        telemetry_log.add_table(name, channel.fields)
+sampler.add_listener(telemetry_log.add_sample)
 instruments = {
     "dc_source": itech,
     "ac_source": chroma,
@@ -388,74 +419,125 @@ instruments = {
     "oscilloscope": mso58b,
     "sleep": "sleep",
     }
+try:
+    if df is None:
+        plan = iter_plan(stream_sequence(filename), instruments)
+    else:
+        plan = compile_plan(df, instruments)
+        _logger.debug(f"Compiled {len(plan)} steps")
+except Exception:
+    _logger.exception("Sequence compile Error")
+    raise
 
 
 ###############################
 # ----- EXECUTE COMMAND ----- #
 ###############################
+def on_step(step, timing):
+    """Log, telemetry and info box at the start of a step"""
+    now = datetime.fromtimestamp(clock.time())
+    if timing.late > 1:
+        _logger.warning(f"Step {step.index} late of {timing.late:.1f} s")
+    telemetry_log.add_step(now.timestamp(), step.index, step.offset,
+                           timing.late, step.instrument, step.label)
+    info_box.update_text(step.target, step.label,
+                         now.strftime("%d/%m/%Y %H:%M:%S"), step.index)
+
+
+lane_errors: list[Exception] = []  # first one raised by run_test
+
+
+def run_lane(steps):
+    """Execute the steps of one lane on the shared timeline. An error stops
+    every lane at its next wait"""
+    step = None
+    try:
+        for step in steps:
+            if scheduler.wait_until(step.offset):
+                _logger.debug(f"Wait before step {step.index} skipped")
+            if step.instrument == "sync":
+                with clock.blocked():
+                    sync_points[step.args[0]].wait()
+            on_step(step, scheduler.fire(step.index, step.offset))
+            if step.func is not None:
+                with getattr(instruments[step.instrument], "lock",
+                             nullcontext()):
+                    step.func(*step.args)
+        if step is not None:
+            scheduler.wait_until(step.offset + step.time)
+    except (SequenceAborted, threading.BrokenBarrierError):
+        _logger.debug(f"{threading.current_thread().name} stopped")
+    except Exception as e:
+        # FIXME Not Exception, but SSH or PYVISA or PYMODBUS EXCEPTION
+        _logger.critical("Error during sequence execution", exc_info=1)
+        lane_errors.append(e)
+        scheduler.abort()
+        for barrier in sync_points.values():
+            barrier.abort()  # do not block the other lanes
+    finally:
+        clock.leave()
+
+
 def run_test():
     _logger.info("Start sequence test")
-    for i in range(lenght):
-        try:
-            # TODO pause_event
-            now = time.time()
-            time_ = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-            skip_event.clear()
-            rel_time = next(list_of_time)
-            instr = instruments.get(next(list_of_instr).lower())
-            # --- ARMxl command --- #
-            if instr == arm_xl:
-                command = next(list_of_command)
-                args = next(list_of_args)
-                cmd = parse_command(command, args)
-                info_box.update_text(instr, f"{command} - {args}", time_, i)
-                instr: Charger
-                instr._shell.send(cmd)
-            # --- sleep command --- #
-            elif instr == "sleep":
-                info_box.update_text(
-                    instr, f"Wait {rel_time} seconds ", time_, i
-                    )
-                _ = next(list_of_command)
-                _ = next(list_of_args)
-            # --- SCPI or MODBUS command --- #
-            elif instr != arm_xl:  # not arm_xl instrument
-                func_ = next(list_of_command).strip()
-                command = getattr(instr, func_)
-                args = arg_parse(next(list_of_args))
-                info_box.update_text(instr, f"{func_} - {args}", time_, i)
-                if args is None:
-                    command()
-                elif isinstance(args, tuple):
-                    command(args)
-                else:
-                    command(*args)
-        except Exception:
-            # FIXME Not Exception, but SSH or PYVISA or PYMODBUS EXCEPTION
-            _logger.critical("Error during sequence execution", exc_info=1)
-            # _ = next(list_of_command)
-            # _ = next(list_of_args)
-            # continue
-            sys.exit(1)  # TODO safe exit
-        else:
-            while time.time() - now < rel_time and not skip_event.is_set():
-                if not play_event.is_set():
-                    passed_time = time.time() - now
-                    rel_time = rel_time - passed_time
-                    play_event.wait()
-                    now = time.time()
+    clock.enter()  # virtual time held until the lanes wait
+    sampler.start()
+    scheduler.start()
+    lanes = split_lanes(plan) if isinstance(plan, tuple) else {"": plan}
+    if len(lanes) == 1:
+        run_lane(next(iter(lanes.values())))
+    else:
+        threads = [threading.Thread(target=run_lane, args=(steps,),
+                                    name=f"Lane {lane}", daemon=True)
+                   for lane, steps in lanes.items()]
+        for thread in threads:
+            clock.enter(thread)
+            thread.start()
+        clock.leave()
+        for thread in threads:
+            thread.join()
+
+    sampler.stop()
+    telemetry_log.flush()
+    if lane_errors:
+        raise lane_errors[0]  # TODO safe exit
+    _logger.info(f"End sequence test: {scheduler.summary()}")
+    info_box.master.destroy()
+
 
+def run_test_async():
+    """Same of run_test, on the asyncio engine"""
+    _logger.info("Start sequence test (asyncio engine)")
+    try:
+        engine.run()
+    except Exception:
+        _logger.critical("Error during sequence execution", exc_info=1)
+        telemetry_log.flush()
+        sys.exit(1)  # TODO safe exit
+    telemetry_log.flush()
     info_box.master.destroy()
 
 
 ###############################
 # ----- INFO TK and RUN ----- #
 ###############################
-skip_event = threading.Event()
-play_event = threading.Event()
-play_event.set()
-info_box = ShowInfo(event=skip_event, data=df, play_event=play_event)
-t = threading.Thread(target=run_test, daemon=True)
+if ASYNC_ENGINE:
+    engine = AsyncSequenceEngine(plan, instruments, sampler, on_step,
+                                 clock)
+    skip_event, play_event = engine.skip_event, engine.play_event
+else:
+    skip_event = ClockEvent()
+    play_event = ClockEvent()
+    play_event.set()
+    scheduler = DeadlineScheduler(skip_event, play_event, clock)
+    sync_points = {name: threading.Barrier(parties) for name, parties in
+                   (sync_parties(plan).items() if isinstance(plan, tuple)
+                    else ())}
+info_box = ShowInfo(event=skip_event,
+                    data=df if df is not None else f"Streaming {filename}",
+                    play_event=play_event)
+t = threading.Thread(target=run_test_async if ASYNC_ENGINE else run_test,
+                     daemon=True)
 t.start()
 info_box.mainloop()
 t.join()
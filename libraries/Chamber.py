@@ -2,15 +2,19 @@
 """Class for all Device that speak with ModBus standard"""
 # import functools
 # from Error import NotAvailable
-import time
-from typing import Annotated, Type, TypedDict, Union
+import threading
+from functools import partial
+from typing import Annotated, NamedTuple, Type, TypedDict, Union
 
+import numpy as np
 from numpy import linspace
 from pymodbus.client.sync import ModbusSerialClient as ModbusClient
 from pymodbus.constants import Endian
 from pymodbus.exceptions import ConnectionException
 from pymodbus.payload import BinaryPayloadBuilder, BinaryPayloadDecoder
 
+from . import ramp
+
 
 class Reading_address(TypedDict):
     measure: dict[str, int]
@@ -24,6 +28,38 @@ class Writing_address(TypedDict):
     setpoint: dict[str, int]
 
 
+class Register_layout(NamedTuple):
+    blocks: list[tuple[int, int]]  # (first address, count) of every read
+    size: int  # registers in the image
+    float_address: np.ndarray  # first register of every float field
+    bit_address: np.ndarray
+    bit_index: np.ndarray
+    dtype: np.dtype  # record of the snapshot
+
+
+def merge_register_blocks(spans: list[tuple[int, int]], max_gap: int = 8,
+                          max_count: int = 125) -> list[tuple[int, int]]:
+    """Unisce gli intervalli di registri vicini nel minor numero di letture\n
+    Args:
+        spans (list[tuple[int, int]]): (primo indirizzo, numero registri)
+        max_gap (int, optional): registri non usati letti pur di unire due
+        intervalli. Defaults to 8.
+        max_count (int, optional): massimo registri per lettura (limite
+        Modbus 125). Defaults to 125.\n
+    Returns:
+        list[tuple[int, int]]: (primo indirizzo, numero registri) dei blocchi
+    """
+    blocks: list[list[int]] = []
+    for start, count in sorted(spans):
+        end = start + count
+        if blocks and start <= blocks[-1][1] + max_gap and \
+                end - blocks[-1][0] <= max_count:
+            blocks[-1][1] = max(blocks[-1][1], end)
+        else:
+            blocks.append([start, end])
+    return [(start, end - start) for start, end in blocks]
+
+
 class ACS_Discovery1200(ModbusClient):
     """Classe per interfacciarsi con ACS_Discovery1200"""
 
@@ -105,6 +141,11 @@ class ACS_Discovery1200(ModbusClient):
     TEMP = (-75, 180)  # range di temperatura possibile
     GRADIENT = (-2.3, 4.5)  # not used, massimo gradientein discesa e salita
     DATA_OUTPUT = ['Chamber_Temp']
+    SNAPSHOT_GAP = 8  # registri non usati letti pur di unire due blocchi
+    # bit di 'run_setting' scritti solo da questo programma, tenuti nella
+    # copia locale. Gli altri (alarm reset) li cambia anche la camera
+    HOST_SETTINGS = ("run", "enable temp", "enable hum")
+    _layout: Register_layout | None = None
 
     def __init__(self, port: str, slave_address: int | None = None,
                  method='rtu', stopbit=1, bytesize=8, parity='N', timeout=1.5,
@@ -119,6 +160,9 @@ class ACS_Discovery1200(ModbusClient):
             self.UNIT = slave_address
         self.temp_control = False
         self.hum_control = False
+        self.lock = threading.RLock()  # una transazione alla volta
+        # copia locale dei bit di 'HOST_SETTINGS': address -> valore
+        self._shadow: dict[int, int] = {}
 
     def _check_connection(self):
         """Verifica se la connessione è attiva
@@ -156,9 +200,9 @@ class ACS_Discovery1200(ModbusClient):
             bool: 'True' se presente un errore. 'False' altrimenti
         """
         # values = 00000001-00000001
-        rr = self.write_registers(500, values=0x0101, unit=self.UNIT)
+        rr = self.__write_register(500, 0x0101)
         self.temp_control = True
-        return rr.isError()
+        return rr
 
     def start_hum(self) -> bool:  # FIXME fare anche reset alarm?
         """Attiva il controllo di umidità e comincia il controllo
@@ -167,9 +211,9 @@ class ACS_Discovery1200(ModbusClient):
             bool: 'True' se presente un errore. 'False' altrimenti
         """
         # values = 00000010-00000001
-        rr = self.write_registers(500, values=0x0201, unit=self.UNIT)
+        rr = self.__write_register(500, 0x0201)
         self.hum_control = True
-        return rr.isError()
+        return rr
 
     def start_temp_hum(self) -> bool:  # FIXME fare anche reset alarm?
         """Attiva il controllo di temperatura e umidità e comincia il controllo
@@ -178,10 +222,10 @@ class ACS_Discovery1200(ModbusClient):
             bool: 'True' se presente un errore. 'False' altrimenti
         """
         # values = 00000011-00000001
-        rr = self.write_registers(500, values=0x0301, unit=self.UNIT)
+        rr = self.__write_register(500, 0x0301)
         self.temp_control = True
         self.hum_control = True
-        return rr.isError()
+        return rr
 
     def stop_temp(self) -> bool:
         """Disattiva controllo temperatura della camera\n
@@ -207,10 +251,10 @@ class ACS_Discovery1200(ModbusClient):
             bool: 'True' se presente un errore. 'False' altrimenti
         """
         # values = 00000000-00000000
-        rr = self.write_registers(500, values=0x0000, unit=self.UNIT)
+        rr = self.__write_register(500, 0x0000)
         self.temp_control = False
         self.hum_control = False
-        return rr.isError()
+        return rr
 
     def reset_alarm(self) -> bool:
         """Imposta a 1 l'alarm_reset della camera\n
@@ -274,6 +318,86 @@ class ACS_Discovery1200(ModbusClient):
             raise KeyError("Setting not present")
         return self.__read_bit(address, bit)
 
+    def read_user_settings(self) -> tuple[bool, dict[str, bool]]:
+        """Legge tutte le impostazioni di 'settings' in una sola lettura\n
+        Returns:
+            tuple[bool, dict[str, bool]]:
+                bool: 'True' se presente un errore. 'False' altrimenti
+                dict[str, bool]: valore di ogni impostazione
+        """
+        settings = self.reading_area["user_setting"]
+        spans = [(address, 1) for address, _ in settings.values()]
+        image = {}
+        for start, count in merge_register_blocks(spans, self.SNAPSHOT_GAP):
+            rr = self.read_holding_registers(start, count, unit=self.UNIT)
+            if rr.isError():
+                return True, {}
+            image.update(zip(range(start, start + count), rr.registers))
+        return False, {meas: bool(image[address] >> bit & 1)
+                       for meas, (address, bit) in settings.items()}
+
+    def read_snapshot(self) -> tuple[bool, np.void]:
+        """Legge tutte le misure, i setpoint e le impostazioni con il minor
+        numero di letture a blocchi (0-37, 69-88) e le decodifica insieme\n
+        Returns:
+            tuple[bool, np.void]:
+                bool: 'True' se presente un errore. 'False' altrimenti
+                np.void: record con i gruppi di 'reading_area', es.
+                record["measure"]["Temp"]. NaN se presente un errore
+        """
+        layout = self._snapshot_layout()
+        image = np.zeros(layout.size, dtype=np.uint32)
+        error = False
+        for start, count in layout.blocks:
+            rr = self.read_holding_registers(start, count, unit=self.UNIT)
+            if rr.isError():
+                error = True
+                break
+            image[start:start + count] = rr.registers
+        if error:
+            floats = np.full(len(layout.float_address), np.nan, np.float32)
+            bits = np.zeros(len(layout.bit_address), dtype=bool)
+        else:
+            # ----- from 2*16bit (big endian) to 32bit float
+            floats = ((image[layout.float_address] << 16)
+                      | image[layout.float_address + 1]).view(np.float32)
+            bits = (image[layout.bit_address] >> layout.bit_index) & 1 == 1
+        record = np.frombuffer(floats.tobytes() + bits.tobytes(),
+                               dtype=layout.dtype)[0]
+        return error, record
+
+    @classmethod
+    def _snapshot_layout(cls) -> Register_layout:
+        """Blocchi di lettura e record dello snapshot, calcolati una volta"""
+        if cls._layout is None:
+            area = cls.reading_area
+            float_fields = [(group, name, address)
+                            for group in ("measure", "setpoint")
+                            for name, address in area[group].items()]
+            bit_fields = [(group, name, address, bit)
+                          for group in ("user_setting", "device_setting")
+                          for name, (address, bit) in area[group].items()]
+            spans = ([(address, 2) for *_, address in float_fields]
+                     + [(address, 1) for *_, address, _ in bit_fields])
+            blocks = merge_register_blocks(spans, cls.SNAPSHOT_GAP)
+            dtype = np.dtype([
+                (group, [(name, np.float32) for g, name, _ in float_fields
+                         if g == group])
+                for group in ("measure", "setpoint")
+                ] + [
+                (group, [(name, np.bool_) for g, name, *_ in bit_fields
+                         if g == group])
+                for group in ("user_setting", "device_setting")
+                ])
+            cls._layout = Register_layout(
+                blocks,
+                max(start + count for start, count in blocks),
+                np.array([address for *_, address in float_fields]),
+                np.array([address for *_, address, _ in bit_fields]),
+                np.array([bit for *_, bit in bit_fields]),
+                dtype)
+        return cls._layout
+
     def __read_float(self, address: int) -> tuple[bool, float]:
         """Legge il registro selezionato più il seguente e restituisce un
         float\n
@@ -335,21 +459,16 @@ class ACS_Discovery1200(ModbusClient):
                 meas = "Hum"
             self.__validate(meas, value)
             address: int = self.writing_area["setpoint"][meas]
+            ramp.ramp_engine.cancel((self, address))  # nuovo setpoint
             # ---- gradient generator
             if time_to_set_m:
-                import threading
-
                 assert isinstance(time_to_set_m, int)
                 if meas == "Hum":
                     meas = "Rel Hum"
-                readed, start_value = self.read_measure(meas)
-                if readed:
-                    grad = threading.Thread(
-                        target=self.__gradient_setpoint,
-                        args=(address, value, time_to_set_m, start_value),
-                        daemon=True,
-                    )
-                    grad.start()
+                error, start_value = self.read_measure(meas)
+                if not error:
+                    return self.__gradient_setpoint(address, value,
+                                                    time_to_set_m, start_value)
         except KeyError:
             raise KeyError("Setpoint not present")
         except ValueError:
@@ -360,22 +479,29 @@ class ACS_Discovery1200(ModbusClient):
         return self.__write_float(address, value)
 
     def __gradient_setpoint(self, address: int, final_value: int | float,
-                            time_to_set: int, start_value: float):
+                            time_to_set: int, start_value: float) -> bool:
         """Approssima il gradiente con una funzione a gradini(pre) ed invia
-        più setpoint intermedi alla macchina
+        più setpoint intermedi alla macchina, uno ogni 60 secondi sulla
+        timeline assoluta del motore di rampa condiviso
         Args:
             address (int): indirizzo di scrittura del setpoint
             final_value (int | float): valore finale da raggiungere
             time_to_set (int): tempo in minuti in cui si vuole raggiungere il
             valore finale
-            start_value (float): valore attuale della misura
+            start_value (float): valore attuale della misura\n
+        Returns:
+            bool: 'True' se presente un errore sul primo setpoint.
+            'False' altrimenti
         """
+        start = ramp.ramp_engine.clock.monotonic()
         step_setpoint = linspace(start_value, final_value, time_to_set + 1)
-        for i in range(1, time_to_set + 1):
-            now = time.time()
-            self.__write_float(address, step_setpoint[i])
-            while time.time() <= (now + 60) and i < (time_to_set):  # aspetta 60 secondi # noqa: E501
-                continue
+        error = self.__write_float(address, step_setpoint[1])
+        if not error:
+            ramp.ramp_engine.start_ramp((self, address),
+                                        partial(self.__write_float, address),
+                                        step_setpoint[2:], 60, start + 60,
+                                        lock=self.lock)
+        return error
 
     def write_setting(self, meas: str, value: bool | int) -> bool:
         """Attiva o disattiva un'impostazione\n
@@ -426,16 +552,101 @@ class ACS_Discovery1200(ModbusClient):
         Returns:
             bool: 'True' se presente un errore. 'False' altrimenti
         """
-        rr = self.read_holding_registers(address, 1, unit=self.UNIT)
-        _all = 0xFFFF
-        _and = _all - 2**bit
-        if value:
-            _or = _all - _and
-        else:
-            _or = 0b0
-        payload = (rr.registers[0] & _and) | _or
-        rw = self.write_registers(address, values=payload, unit=self.UNIT)
-        return rw.isError()
+        return self.__write_bits(address, {bit: value})
+
+    def __write_bits(self, address: int,
+                     bits: dict[Annotated[int, range(16)], bool | int]
+                     ) -> bool:
+        """Scrive più bit dello stesso registro con una sola scrittura,
+        partendo dalla copia locale dei bit scritti solo da questo programma
+        ('HOST_SETTINGS'). La copia è riletta in blocco se non valida o se è
+        coinvolto un bit che la camera cambia da sola (alarm reset)\n
+        Args:
+            address (int): indirizzo del registro
+            bits (dict[int, bool | int]): bit (0-based) e valore da scrivere\n
+        Returns:
+            bool: 'True' se presente un errore. 'False' altrimenti
+        """
+        with self.lock:  # lettura e scrittura senza altre transazioni
+            host = self.__host_mask(address)
+            if (address not in self._shadow
+                    or any(not host >> bit & 1 for bit in bits)):
+                if self.refresh_settings():
+                    return True
+            payload = self._shadow.get(address, 0)
+            for bit, value in bits.items():
+                if value:
+                    payload |= 1 << bit
+                else:
+                    payload &= ~(1 << bit) & 0xFFFF
+            return self.__write_register(address, payload)
+
+    def __write_register(self, address: int, value: int) -> bool:
+        """Scrive il registro e aggiorna la copia locale (invalidata se
+        presente un errore)\n
+        Returns:
+            bool: 'True' se presente un errore. 'False' altrimenti
+        """
+        try:
+            rw = self.write_registers(address, values=value, unit=self.UNIT)
+        except Exception:
+            self._shadow.clear()
+            raise
+        if rw.isError():
+            self._shadow.clear()
+            return True
+        host = self.__host_mask(address)
+        if host:
+            self._shadow[address] = value & host
+        return False
+
+    @classmethod
+    def __host_mask(cls, address: int) -> int:
+        """Bit del registro scritti solo da questo programma"""
+        return sum(1 << bit for name, (_address, bit)
+                   in cls.writing_area["run_setting"].items()
+                   if _address == address and name in cls.HOST_SETTINGS)
+
+    def refresh_settings(self) -> bool:
+        """Rilegge in blocco le impostazioni ('read_user_settings') nella
+        copia locale dei bit di 'HOST_SETTINGS'\n
+        Returns:
+            bool: 'True' se presente un errore. 'False' altrimenti
+        """
+        self._shadow.clear()
+        error, settings = self.read_user_settings()
+        if error:
+            return True
+        for name, (address, bit) in self.writing_area["run_setting"].items():
+            if name in self.HOST_SETTINGS:
+                value = self._shadow.get(address, 0)
+                self._shadow[address] = value | settings[name] << bit
+        return False
+
+    def write_settings(self, settings: dict[str, bool | int]) -> bool:
+        """Attiva o disattiva più impostazioni insieme, con una sola
+        scrittura per registro\n
+        Args:
+            settings (dict[str, bool | int]): impostazione (tra quelle in
+            'settings') e valore da scrivere\n
+        Raises:
+            KeyError: se impostazione non presente
+            ValueError: se valore non valido\n
+        Returns:
+            bool: 'True' se presente un errore. 'False' altrimenti
+        """
+        registers: dict[int, dict[int, bool | int]] = {}
+        for meas, value in settings.items():
+            try:
+                self.__validate(meas, value)
+                address, bit = self.writing_area["run_setting"][meas]
+            except KeyError:
+                raise KeyError("Setting not present")
+            except ValueError:
+                raise ValueError("Valore non valido")
+            registers.setdefault(address, {})[bit] = value
+        return any([self.__write_bits(address, bits)
+                    for address, bits in registers.items()])
 
     # ----- other function -----
     @classmethod
@@ -524,6 +735,7 @@ class Sauter_PLC(ModbusClient):  # VERIFY da verificare funzionamento classe
         if slave_address:
             self.UNIT = slave_address
         self.temp_control = {1: False, 2: False, 3: False, 4: False, 5: False}
+        self.lock = threading.RLock()  # una transazione alla volta
         # self.hum_control = { 1:False, #NEW FEATURE if hum control is possible
         #                      2:False,
         #                      3:False,
@@ -1,16 +1,184 @@
 #!/usr/bin/env python
 """Class for all Device that need connection with paramiko (SSH)"""
+import hashlib
+import logging
+import os
+import posixpath
+import queue
+import shlex
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from stat import S_ISDIR, S_ISREG
-from typing import Type
+from typing import Callable, Iterable, NamedTuple, Type
 
 import paramiko
 
-# import logging
-# _logger = logging.getLogger(__name__)
+from .connection_manager import connect_all
+
+_logger = logging.getLogger(__name__)
+
+
+class CommandResult:
+    """Esito di un comando lanciato in background"""
+
+    def __init__(self, command: str) -> None:
+        self.command = command
+        self.started = time.monotonic()
+        self.elapsed: float | None = None  # s, None se ancora in esecuzione
+        self.exit_status: int | None = None
+        self.stdout = ""
+        self.stderr = ""
+        self.error: BaseException | None = None  # errore di connessione
+        self._done = threading.Event()
+        self._callbacks: list[Callable[["CommandResult"], object]] = []
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        state = "running" if not self.done else f"exit {self.exit_status}"
+        return f"<CommandResult {self.command!r} {state}>"
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    @property
+    def ok(self) -> bool:
+        """'True' se terminato con exit status 0"""
+        return self.done and self.error is None and self.exit_status == 0
+
+    def wait(self, timeout: float | None = None) -> "CommandResult":
+        """Attende la fine del comando\n
+        Raises:
+            TimeoutError: se non termina entro timeout secondi
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"{self.command!r} not completed in "
+                               f"{timeout} s")
+        return self
+
+    def add_done_callback(self, callback: Callable[["CommandResult"],
+                                                   object]):
+        """Chiama 'callback(result)' alla fine del comando"""
+        with self._lock:
+            if not self.done:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _set_done(self):
+        self.elapsed = time.monotonic() - self.started
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                _logger.exception(f"Callback of {self.command!r}")
+
+
+class ChannelPool:
+    """Canali SSH aperti in anticipo e raccolta dei risultati in background.
+
+    Un canale 'exec' di SSH esegue un solo comando, quindi il pool tiene
+    pronti 'size' canali già aperti e li riapre in background dopo l'uso:
+    l'apertura del canale non pesa sul lancio del comando.
+    La raccolta dei risultati ha i suoi thread ('workers'): comandi lunghi
+    non fermano la riapertura dei canali.
+    """
+    CHUNK = 32768  # byte letti alla volta
+    POLL = 0.01  # s, attesa se il canale non ha dati pronti
+
+    def __init__(self, transport: paramiko.Transport, size: int = 2,
+                 workers: int = 8) -> None:
+        self._transport = transport
+        self.size = size
+        self._idle: queue.SimpleQueue[paramiko.Channel] = queue.SimpleQueue()
+        self._refiller = ThreadPoolExecutor(max_workers=1,
+                                            thread_name_prefix="ssh-open")
+        self._collector = ThreadPoolExecutor(max_workers=workers,
+                                             thread_name_prefix="ssh")
+        for _ in range(size):
+            self._refiller.submit(self._refill)
+
+    def execute(self, command: str) -> CommandResult:
+        """Lancia il comando senza attenderne la fine\n
+        Args:
+            command (str): comando da eseguire nella shell remota\n
+        Returns:
+            CommandResult: esito, completato in background
+        """
+        result = CommandResult(command)
+        channel = self._acquire()
+        channel.exec_command(command)
+        self._collector.submit(self._collect, channel, result)
+        self._refiller.submit(self._refill)
+        return result
+
+    def close(self):
+        self._refiller.shutdown(wait=False, cancel_futures=True)
+        self._collector.shutdown(wait=False, cancel_futures=True)
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def _acquire(self) -> paramiko.Channel:
+        while True:
+            try:
+                channel = self._idle.get_nowait()
+            except queue.Empty:
+                return self._transport.open_session()
+            if not channel.closed and self._transport.is_active():
+                return channel
+
+    def _refill(self):
+        if self._idle.qsize() >= self.size or not self._transport.is_active():
+            return
+        try:
+            self._idle.put(self._transport.open_session())
+        except paramiko.SSHException:
+            _logger.debug("SSH channel not opened", exc_info=True)
+
+    @classmethod
+    def _collect(cls, channel: paramiko.Channel, result: CommandResult):
+        stdout, stderr = bytearray(), bytearray()
+        try:
+            with channel:
+                # stdout e stderr letti insieme: se uno dei due riempie la
+                # finestra del canale il comando non si blocca
+                while True:
+                    if channel.recv_ready():
+                        stdout += channel.recv(cls.CHUNK)
+                    elif channel.recv_stderr_ready():
+                        stderr += channel.recv_stderr(cls.CHUNK)
+                    elif channel.exit_status_ready() and (
+                            channel.eof_received or channel.closed):
+                        break
+                    else:
+                        time.sleep(cls.POLL)
+                result.exit_status = channel.recv_exit_status()
+        except Exception as e:
+            result.error = e
+        result.stdout = stdout.decode("UTF-8", errors="replace").strip()
+        result.stderr = stderr.decode("UTF-8", errors="replace").strip()
+        result._set_done()
+
+
+class SyncResult(NamedTuple):
+    """Esito di 'Charger.sync_dir'"""
+    copied: list[str]
+    skipped: list[str]
+    removed: list[str]
 
 
 class Charger:
     """Classe connessione charger"""
+    ssh_client: Callable[[], paramiko.SSHClient] = paramiko.SSHClient
 
     def __init__(self, host: str, user: str = "root", pwd: str = "abb") -> None:    # noqa: E501
         """Inizializza il client SSH e si connette tramite l'host, l'user e la
@@ -22,10 +190,13 @@ class Charger:
         """
         self._sftp: paramiko.SFTPClient | None = None
         self._shell = None
+        self._pool: ChannelPool | None = None
+        self.results: deque[CommandResult] = deque(maxlen=100)  # ultimi
         # crate a client
-        self._client = paramiko.SSHClient()
+        self._client = self.ssh_client()
         self._client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         self._client.load_system_host_keys()
+        self.host = host
         self._client.connect(hostname=host, username=user, password=pwd,
                              timeout=5)
         self.hostname = self.get_hostname()
@@ -34,9 +205,12 @@ class Charger:
         self._transport = self._client.get_transport()
         self._transport.set_keepalive(60)
         self._shell = self._client.invoke_shell()  # new Channel for shell
+        self._pool = ChannelPool(self._transport)
 
     def __del__(self):
         """chiude tutti i canali"""
+        if self._pool is not None:
+            self._pool.close()
         if self._sftp is not None:
             self._sftp.close()
         if self._shell is not None:
@@ -54,21 +228,73 @@ class Charger:
         Returns:
             (str): risposta del server. Risposta o Errore
         """
-        stdin, stdout, stderr = self._client.exec_command(command)
         if args:
+            stdin, stdout, stderr = self._client.exec_command(command)
             stdin.write(f"{args}")
-        out = stdout.read().decode(encoding="UTF-8").strip()
-        error = stderr.read().decode(encoding="UTF-8").strip()
+            out = stdout.read().decode(encoding="UTF-8").strip()
+            error = stderr.read().decode(encoding="UTF-8").strip()
 
-        stdin.close()
-        stdout.close()
-        stderr.close()
+            stdin.close()
+            stdout.close()
+            stderr.close()
+        else:  # canale già aperto dal pool
+            result = self.execute(command).wait()
+            if result.error is not None:
+                raise result.error
+            out, error = result.stdout, result.stderr
 
         if out != "":
             return out
         else:
             return error
 
+    def execute(self, command: str) -> CommandResult:
+        """Lancia il comando senza attenderne la fine. Exit status e output
+        sono raccolti in background; un errore viene scritto nel log\n
+        Args:
+            command (str): stringa eseguita nella shell di arrivo\n
+        Returns:
+            CommandResult: esito del comando
+        """
+        result = self._pool.execute(command)
+        self.results.append(result)
+        result.add_done_callback(self._log_result)
+        return result
+
+    def run_script(self, script: str, args: str = "", wait: bool = False
+                   ) -> CommandResult:
+        """Lancia uno script ARES (es. 'set_power.sh') in background\n
+        Args:
+            script (str): nome dello script nella directory corrente
+            args (str, optional): argomenti separati da spazio
+            wait (bool, optional): 'False' lo script è staccato dalla
+            sessione (nohup, output scartato): continua anche dopo 'close' o
+            se cade la connessione, l'esito riporta solo il lancio. 'True'
+            l'esito riporta exit status e output dello script, che però
+            termina con il canale. Defaults to False.\n
+        Returns:
+            CommandResult: esito del comando
+        """
+        return self.execute(self.script_command(script, args, wait))
+
+    @staticmethod
+    def script_command(script: str, args: str = "", wait: bool = False
+                       ) -> str:
+        """Comando della shell per lo script ARES (vedi 'run_script')"""
+        command = f"./{script} {args}".strip()
+        if wait:
+            return command
+        return f"nohup {command} >/dev/null 2>&1 &"
+
+    def _log_result(self, result: CommandResult):
+        if result.ok:
+            _logger.debug(f"{self}: {result.command!r} done in "
+                          f"{result.elapsed:.3f} s")
+        else:
+            _logger.error(f"{self}: {result.command!r} failed "
+                          f"(exit {result.exit_status}, {result.error!r}): "
+                          f"{result.stderr}")
+
     def get_hostname(self):
         """Get name of host\n
         Returns:
@@ -167,16 +393,236 @@ class Charger:
         """
         self._sftp.get(remotepath, localpath)
 
+    def sync_dir(self, localdir: str, remotedir: str, mode: int = 0o775,
+                 checksum: bool = False, delete: bool = False) -> SyncResult:
+        """Sincronizza i file della cartella locale nella cartella remota,
+        copiando solo quelli cambiati\n
+        Un file è cambiato se manca, ha dimensione o data di modifica
+        diversa (la copia remota riceve la data del file locale); con
+        'checksum' se ha sha1 diverso.
+        La lista remota è letta una volta sola, i file sono scritti in
+        pipeline e i permessi impostati con un solo comando.\n
+        Args:
+            localdir (str): cartella locale (non ricorsivo)
+            remotedir (str): cartella remota, creata se non presente
+            mode (int, optional): permessi dei file copiati.
+            Defaults equivalent to 'rwxrwxr-x'.
+            checksum (bool, optional): confronta sha1 invece di data.
+            Defaults to False.
+            delete (bool, optional): rimuove i file remoti non presenti in
+            locale. Defaults to False.\n
+        Returns:
+            SyncResult: file copiati, invariati e rimossi
+        """
+        if self._sftp is None:
+            raise paramiko.SSHException("Connessione SFTP non effettuata")
+        try:
+            remote = {a.filename: a
+                      for a in self._sftp.listdir_attr(remotedir)
+                      if S_ISREG(a.st_mode)}
+        except FileNotFoundError:
+            self._sftp.mkdir(remotedir)
+            remote = {}
+        local = {entry.name: entry.stat() for entry in os.scandir(localdir)
+                 if entry.is_file()}
+
+        if checksum:
+            changed = set(local) - set(remote)
+            common = sorted(set(local) & set(remote))
+            remote_hash = self.__remote_sha1(remotedir, common)
+            for name in common:
+                with open(os.path.join(localdir, name), "rb") as f:
+                    local_hash = hashlib.sha1(f.read()).hexdigest()
+                if remote_hash.get(name) != local_hash:
+                    changed.add(name)
+        else:
+            changed = {name for name, st in local.items()
+                       if name not in remote
+                       or remote[name].st_size != st.st_size
+                       or int(remote[name].st_mtime) != int(st.st_mtime)}
+        copied = sorted(changed)
+        for name in copied:
+            with open(os.path.join(localdir, name), "rb") as f:
+                # putfo scrive in pipeline, senza attendere ogni blocco
+                remote_path = posixpath.join(remotedir, name)
+                self._sftp.putfo(f, remote_path, local[name].st_size,
+                                 confirm=False)
+            # putfo non conserva la data: confronto locale-locale al
+            # prossimo sync, indipendente dall'orologio del charger
+            self._sftp.utime(remote_path, (local[name].st_atime,
+                                           local[name].st_mtime))
+        removed = sorted(set(remote) - set(local)) if delete else []
+        for name in removed:
+            self._sftp.remove(posixpath.join(remotedir, name))
+        if copied:
+            paths = " ".join(shlex.quote(posixpath.join(remotedir, name))
+                             for name in copied)
+            result = self.execute(f"chmod {mode:o} {paths}").wait()
+            if not result.ok:
+                raise paramiko.SSHException(f"chmod failed: {result.stderr}")
+        _logger.debug(f"{self}: sync {localdir} -> {remotedir}, "
+                      f"{len(copied)} copied, {len(removed)} removed")
+        return SyncResult(copied, sorted(set(local) - changed), removed)
+
+    def __remote_sha1(self, remotedir: str, names: list[str]
+                      ) -> dict[str, str]:
+        """sha1 dei file remoti con un solo comando"""
+        if not names:
+            return {}
+        result = self.execute(
+            f"cd {shlex.quote(remotedir)} && sha1sum "
+            + " ".join(shlex.quote(name) for name in names)).wait()
+        hashes = {}
+        for line in result.stdout.splitlines():
+            digest, _, name = line.partition("  ")
+            hashes[name] = digest
+        return hashes
+
     # ----- close -----
     def close(self):
         """Chiude tutti i canali"""
+        if self._pool is not None:
+            self._pool.close()
         if self._sftp is not None:
             self._sftp.close()
         self._shell.close()
         self._client.close()
 
 
-CONNECTION: dict[str, Type[Charger]] = {"Arm-Xl": Charger}
+class HostResult(NamedTuple):
+    """Esito di un comando su un host del gruppo"""
+    host: str
+    result: CommandResult | None  # None se il comando non è partito
+    sent: float  # s dall'inizio del broadcast all'invio del comando
+    error: BaseException | None
+
+
+class ChargerGroup:
+    """Più charger comandati insieme.
+
+    I comandi vengono inviati a tutti gli host nello stesso istante (un
+    thread per host, sbloccati insieme) e raccolti in background, così uno
+    step di potenza arriva a tutte le unità entro pochi millisecondi.
+    """
+    charger: Type[Charger] = Charger
+    SEND_TIMEOUT = 10  # s, attesa massima degli altri host prima dell'invio
+
+    def __init__(self, hosts: Iterable[str], user: str = "root",
+                 pwd: str = "abb", timeout: float = 30) -> None:
+        """Si connette in parallelo a tutti gli host\n
+        Args:
+            hosts (Iterable[str]): indirizzi host
+            user (str, optional): username. Defaults to 'root'.
+            pwd (str, optional): password. Defaults to 'abb'.
+            timeout (float, optional): secondi per la connessione di ogni
+            host. Defaults to 30.\n
+        Raises:
+            ConnectionError: se un host non è connesso
+        """
+        hosts = list(dict.fromkeys(hosts))
+        factories = {host: partial(self.charger, host, user, pwd)
+                     for host in hosts}
+        results = connect_all(factories, timeout)
+        self.chargers: dict[str, Charger] = {
+            host: r.instrument for host, r in results.items() if r.connected}
+        failed = {host: r.error for host, r in results.items()
+                  if not r.connected}
+        if failed:
+            self.close()
+            raise ConnectionError(f"Charger not connected: {failed}")
+        self._executor = ThreadPoolExecutor(max_workers=len(hosts),
+                                            thread_name_prefix="charger")
+        self._lock = threading.Lock()  # un broadcast alla volta sul pool
+
+    def __str__(self):
+        return f"ARMxl group {list(self.chargers)}"
+
+    def __len__(self) -> int:
+        return len(self.chargers)
+
+    def broadcast(self, command: str, hosts: Iterable[str] | None = None
+                  ) -> dict[str, HostResult]:
+        """Lancia lo stesso comando su tutti gli host (o su 'hosts')
+        contemporaneamente, senza attenderne la fine. Più broadcast (es. da
+        lane diverse) sono eseguiti uno alla volta\n
+        Args:
+            command (str): comando da eseguire
+            hosts (Iterable[str] | None, optional): sottoinsieme di host,
+            ripetuti una volta sola. Defaults to all.\n
+        Raises:
+            KeyError: se un host non fa parte del gruppo\n
+        Returns:
+            dict[str, HostResult]: esito per host; 'result.wait()' attende
+            la fine del comando
+        """
+        targets = ([self.chargers[h] for h in dict.fromkeys(hosts)]
+                   if hosts is not None else list(self.chargers.values()))
+        if not targets:
+            return {}
+        barrier = threading.Barrier(len(targets))
+
+        def send(charger: Charger) -> HostResult:
+            try:
+                barrier.wait(self.SEND_TIMEOUT)
+            except threading.BrokenBarrierError as e:
+                return HostResult(charger.host, None,
+                                  time.monotonic() - start, e)
+            sent = time.monotonic() - start
+            try:
+                return HostResult(charger.host, charger.execute(command),
+                                  sent, None)
+            except Exception as e:
+                return HostResult(charger.host, None, sent, e)
+
+        # il pool ha un thread per host: un solo broadcast alla volta,
+        # altrimenti ogni barriera avrebbe solo una parte dei thread
+        with self._lock:
+            start = time.monotonic()
+            futures = [self._executor.submit(send, c) for c in targets]
+            results = {r.host: r for r in (f.result() for f in futures)}
+        sent = [r.sent for r in results.values()]
+        _logger.debug(f"{command!r} sent to {len(results)} host, spread "
+                      f"{(max(sent) - min(sent)) * 1000:.1f} ms")
+        return results
+
+    def run_script(self, script: str, args: str = "",
+                   hosts: Iterable[str] | None = None, wait: bool = False
+                   ) -> dict[str, HostResult]:
+        """Lancia uno script ARES su tutti gli host (o su 'hosts'), staccato
+        dalla sessione se non 'wait' (vedi 'Charger.run_script')\n
+        Raises:
+            ValueError: se lo script ha meno parametri del minimo in
+            ARES_COMMAND
+        """
+        n_args = len(str(args).split()) if args not in ("", "-") else 0
+        if n_args < ARES_COMMAND.get(script, 0):
+            raise ValueError(f"{script} needs {ARES_COMMAND[script]} "
+                             f"parameters, got {n_args}")
+        return self.broadcast(
+            self.charger.script_command(script, args, wait), hosts)
+
+    def wait(self, results: dict[str, HostResult],
+             timeout: float | None = None) -> dict[str, HostResult]:
+        """Attende la fine dei comandi lanciati con 'broadcast'"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for r in results.values():
+            if r.result is not None:
+                r.result.wait(None if deadline is None
+                              else max(0, deadline - time.monotonic()))
+        return results
+
+    def close(self):
+        for charger in self.chargers.values():
+            charger.close()
+        executor = getattr(self, "_executor", None)
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+CONNECTION: dict[str, Type[Charger] | Type[ChargerGroup]] = {
+    "Arm-Xl": Charger,
+    "Arm-Xl group": ChargerGroup,
+    }
 ARES_COMMAND =  {  # command save on ARES and minimum parameter needed # FIXME find this from Instrument if possible
     "set_voltage_and_power.sh": 2,
     "start_charge_session.sh": 0,
@@ -0,0 +1,295 @@
+"""Asyncio execution engine: steps, ramps, telemetry and pause/skip as tasks
+on one event loop"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from typing import Any, Callable, Iterable
+
+from . import ramp
+from .clock import Clock
+from .loader import DEFAULT_LANE
+from .plan import Step, split_lanes, sync_parties
+from .scheduler import StepTiming, timing_summary
+from .telemetry import Channel, Sampler
+
+_logger = logging.getLogger(__name__)
+
+
+class LoopEvent:
+    """Event of the engine loop, settable from any thread (e.g. the GUI).
+    Same interface of 'threading.Event' for set, clear and is_set, and of
+    'ClockEvent' for watch and unwatch"""
+
+    def __init__(self) -> None:
+        self._event = asyncio.Event()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._watchers: list[Callable[[], Any]] = []
+
+    def set(self):
+        self._call(self._set)
+
+    def watch(self, callback: Callable[[], Any]):
+        """Call 'callback' (loop thread) when the event is set"""
+        self._watchers.append(callback)
+
+    def unwatch(self, callback: Callable[[], Any]):
+        self._watchers.remove(callback)
+
+    def clear(self):
+        self._call(self._event.clear)
+
+    def is_set(self) -> bool:
+        return self._event.is_set()
+
+    async def wait(self) -> bool:
+        return await self._event.wait()
+
+    def _bind(self, loop: asyncio.AbstractEventLoop | None):
+        self._loop = loop
+
+    def _set(self):
+        self._event.set()
+        for watcher in list(self._watchers):
+            watcher()
+
+    def _call(self, func: Callable):
+        loop = self._loop
+        if loop is None or not loop.is_running():
+            func()
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            func()
+        else:
+            loop.call_soon_threadsafe(func)
+
+
+class _SyncPoint:
+    """Wait until all the lanes of the sync point reach it"""
+
+    def __init__(self, parties: int) -> None:
+        self._missing = parties
+        self._event = asyncio.Event()
+
+    async def wait(self):
+        self._missing -= 1
+        if self._missing <= 0:
+            self._event.set()
+        await self._event.wait()
+
+
+class AsyncInstrument:
+    """Async adapter of a blocking instrument (pyvisa, pymodbus, paramiko).
+
+    Every call runs on the single thread of the instrument, holding its
+    lock: the I/O of one instrument is serialized, different instruments
+    run concurrently.
+    """
+
+    def __init__(self, instrument: Any, name: str) -> None:
+        self.instrument = instrument
+        self.lock = getattr(instrument, "lock", None) or nullcontext()
+        self._executor = ThreadPoolExecutor(max_workers=1,
+                                            thread_name_prefix=name)
+
+    async def call(self, func: Callable, *args):
+        """Run 'func(*args)' on the instrument thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor,
+                                          partial(self._locked, func, *args))
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.instrument, name)
+        if callable(attr):
+            return partial(self.call, attr)
+        return attr
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def _locked(self, func: Callable, *args):
+        with self.lock:
+            return func(*args)
+
+
+class AsyncSequenceEngine:
+    """Execute a plan on an asyncio event loop.
+
+    Steps follow the same absolute timeline of 'DeadlineScheduler' (pause
+    shifts it, skip moves it back to now). Every lane of the plan is a task,
+    so the I/O of one lane never delays the others; lanes wait each other
+    only on their sync points. While the engine runs the ramps
+    of the instruments are tasks of the same loop and every sampler channel
+    is polled by its own task instead of the sampler thread.
+    Every time and wait is read from 'clock' (virtual time for rehearsal).
+    """
+
+    PAUSE_POLL = 0.25  # s of real time, max delay to notice a pause
+
+    def __init__(self, plan: Iterable[Step], instruments: dict[str, Any],
+                 sampler: Sampler | None = None,
+                 on_step: Callable[[Step, StepTiming], Any] | None = None,
+                 clock: Clock | None = None) -> None:
+        """
+        Args:
+            plan (Iterable[Step]): steps in execution order
+            instruments (dict[str, Any]): connected instrument by lower name
+            sampler (Sampler | None, optional): channels to poll. Defaults
+            to None.
+            on_step (Callable[[Step, StepTiming], Any] | None, optional):
+            called in the loop when a step starts. Defaults to None.
+            clock (Clock | None, optional): time of the steps, ramps and
+            samples. Defaults to real time.
+        """
+        self.plan = plan
+        self.clock = clock if clock is not None else Clock()
+        self.sampler = sampler
+        self.on_step = on_step
+        self.skip_event = LoopEvent()
+        self.play_event = LoopEvent()
+        self.play_event.set()
+        self.timings: list[StepTiming] = []
+        self.adapters = {name: AsyncInstrument(instr, name)
+                         for name, instr in instruments.items()
+                         if instr is not None and name != "sleep"}
+        self._origin = 0.0
+        self._shift = 0.0
+        self._pending: dict[str, float] = {}  # lane -> offset waited
+        self._paused_at: float | None = None
+        self._sync: dict[str, _SyncPoint] = {}
+
+    def run(self) -> list[StepTiming]:
+        """Run the sequence, blocking until its end"""
+        return asyncio.run(self.run_async())
+
+    async def run_async(self) -> list[StepTiming]:
+        loop = asyncio.get_running_loop()
+        for event in (self.skip_event, self.play_event):
+            event._bind(loop)
+        engine = ramp.AsyncRampEngine(loop, clock=self.clock)
+        previous = ramp.use_engine(engine)
+        polls = [asyncio.create_task(self._poll(channel))
+                 for channel in (self.sampler.channels.values()
+                                 if self.sampler else ())]
+        for task in polls:
+            self.clock.enter(task)
+        try:
+            await self._run_steps()
+        finally:
+            for task in polls:
+                task.cancel()
+            await asyncio.gather(*polls, return_exceptions=True)
+            ramp.use_engine(previous).cancel_all()
+            for event in (self.skip_event, self.play_event):
+                event._bind(None)
+            for adapter in self.adapters.values():
+                adapter.close()
+        _logger.info(f"End sequence: {self.summary()}")
+        return self.timings
+
+    def summary(self) -> str:
+        return timing_summary(self.timings)
+
+    def elapsed(self) -> float:
+        return self.clock.monotonic() - self._origin - self._shift
+
+    async def _run_steps(self):
+        self._origin = self.clock.monotonic()
+        self._shift = 0.0
+        self._pending.clear()
+        self._paused_at = None
+        self.timings.clear()
+        if isinstance(self.plan, (tuple, list)):
+            lanes = split_lanes(self.plan)
+            self._sync = {name: _SyncPoint(n)
+                          for name, n in sync_parties(self.plan).items()}
+        else:  # streamed plan, single lane
+            lanes = {DEFAULT_LANE: self.plan}
+        tasks = [asyncio.create_task(self._run_lane(lane, steps))
+                 for lane, steps in lanes.items()]
+        for task in tasks:
+            self.clock.enter(task)
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run_lane(self, lane: str, steps: Iterable[Step]):
+        step = None
+        for step in steps:
+            if await self._wait_until(lane, step.offset):
+                _logger.debug(f"Wait before step {step.index} skipped")
+            if step.instrument == "sync":
+                with self.clock.blocked():
+                    await self._sync[step.args[0]].wait()
+            fired = self.elapsed()
+            timing = StepTiming(step.index, step.offset, fired,
+                                fired - step.offset)
+            self.timings.append(timing)
+            if self.on_step is not None:
+                self.on_step(step, timing)
+            if step.func is not None:
+                await self.adapters[step.instrument].call(step.func,
+                                                          *step.args)
+        if step is not None:
+            await self._wait_until(lane, step.offset + step.time)
+
+    async def _wait_until(self, lane: str, offset: float) -> bool:
+        """See 'DeadlineScheduler.wait_until'"""
+        self._pending[lane] = offset
+        skipped = False
+        try:
+            while True:
+                if not self.play_event.is_set():
+                    if self._paused_at is None:
+                        self._paused_at = self.clock.monotonic()
+                    with self.clock.blocked():
+                        await self.play_event.wait()
+                    if self._paused_at is not None:  # first to resume
+                        self._shift += self.clock.monotonic() - self._paused_at
+                        self._paused_at = None
+                remaining = (self._origin + self._shift + offset
+                             - self.clock.monotonic())
+                if remaining <= 0:
+                    return skipped
+                poll = self.PAUSE_POLL * self.clock.speed
+                if not await self.clock.async_wait(self.skip_event,
+                                                   min(remaining, poll)):
+                    continue
+                if self.skip_event.is_set():
+                    self.skip_event.clear()
+                    # new timeline: first pending step planned now
+                    first = min(self._pending.values())
+                    self._shift -= (self._origin + self._shift + first
+                                    - self.clock.monotonic())
+                    skipped = skipped or offset <= first
+        finally:
+            del self._pending[lane]
+
+    async def _poll(self, channel: Channel):
+        """Sample the channel on its absolute timeline"""
+        instrument = getattr(channel.read, "__self__", None)
+        adapter = next((a for a in self.adapters.values()
+                        if a.instrument is instrument), None)
+        loop = asyncio.get_running_loop()
+        deadline = self.clock.monotonic()
+        while True:
+            await self.clock.async_sleep(deadline - self.clock.monotonic())
+            timestamp = self.clock.time()
+            if adapter is not None:
+                # instrument thread: never concurrent with its commands
+                row = await adapter.call(channel.sample, timestamp)
+            else:
+                row = await loop.run_in_executor(None, channel.sample,
+                                                 timestamp)
+            self.sampler.publish(channel.name, timestamp, row)
+            missed = (self.clock.monotonic() - deadline) // channel.period
+            deadline += (max(missed, 0) + 1) * channel.period
+
@@ -0,0 +1,376 @@
+"""Clocks of the sequence execution: real time or virtual time (rehearsal)
+
+Every wait of the scheduler, of the ramp engines and of the sampler goes
+through a clock, so a whole sequence can run on the simulated instruments
+in a fraction of its real duration:
+
+- 'Clock': real time (default)
+- 'ScaledClock': virtual time running 'speed' times faster than real time
+- 'VirtualClock': as fast as possible, the time jumps to the next deadline
+  when every participant waits on the clock
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, Callable, Hashable, Iterator
+
+
+class ClockEvent(threading.Event):
+    """'threading.Event' that wakes the clock waits on it once set (skip,
+    stop of the sampler): 'VirtualClock' is notified, never polls it"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._watchers: list[Callable[[], Any]] = []
+
+    def set(self):
+        super().set()
+        for watcher in list(self._watchers):
+            watcher()
+
+    def watch(self, callback: Callable[[], Any]):
+        """Call 'callback' (any thread) when the event is set"""
+        self._watchers.append(callback)
+
+    def unwatch(self, callback: Callable[[], Any]):
+        self._watchers.remove(callback)
+
+
+class Clock:
+    """Real time: 'time.monotonic', 'time.time' and real waits.
+
+    Timeouts are in clock seconds, divided by 'speed' to wait real time.
+    'enter', 'leave' and 'blocked' only matter to 'VirtualClock'.
+    """
+    speed = 1.0  # clock seconds in one real second
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def time(self) -> float:
+        """Wall clock (epoch seconds)"""
+        return time.time()
+
+    def wait(self, event: threading.Event, timeout: float | None) -> bool:
+        """Same as 'event.wait(timeout)'"""
+        return event.wait(self._real(timeout))
+
+    def wait_condition(self, cond: threading.Condition,
+                       timeout: float | None) -> bool:
+        """Same as 'cond.wait(timeout)' (lock of 'cond' held)"""
+        return cond.wait(self._real(timeout))
+
+    def notify(self, cond: threading.Condition):
+        """Same as 'cond.notify()' (lock of 'cond' held)"""
+        cond.notify()
+
+    def sleep(self, seconds: float):
+        time.sleep(self._real(seconds))
+
+    def enter(self, owner: Hashable | None = None):
+        """Register a participant of the timeline: a thread or an asyncio
+        task (default: the caller), before it starts. The virtual time does
+        not advance while a participant runs (e.g. blocking I/O)"""
+
+    def leave(self, owner: Hashable | None = None):
+        """Unregister a participant (default: the caller). Asyncio tasks
+        leave when done"""
+
+    @contextmanager
+    def blocked(self) -> Iterator[None]:
+        """The caller is blocked outside the clock (pause, sync point): the
+        virtual time can advance meanwhile"""
+        yield
+
+    async def async_sleep(self, seconds: float):
+        await self._async_sleep(seconds, asyncio.current_task())
+
+    async def async_wait(self, event: Any, timeout: float) -> bool:
+        """Wait an event with an awaitable 'wait()' (asyncio.Event) at most
+        'timeout' seconds\n
+        Returns:
+            bool: 'True' if the event is set. 'False' on timeout
+        """
+        if event.is_set():
+            return True
+        owner = asyncio.current_task()
+        waiter = asyncio.ensure_future(event.wait())
+        timer = asyncio.ensure_future(
+            self._async_sleep(timeout, owner, event))
+        try:
+            await asyncio.wait((waiter, timer),
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (waiter, timer):
+                task.cancel()
+            await asyncio.gather(waiter, timer, return_exceptions=True)
+        return event.is_set()
+
+    async def _async_sleep(self, seconds: float, owner: Hashable,
+                           event: Any = None):
+        await asyncio.sleep(self._real(seconds))
+
+    def _real(self, timeout: float | None) -> float | None:
+        return None if timeout is None else max(0, timeout) / self.speed
+
+
+class ScaledClock(Clock):
+    """Virtual time running 'speed' times faster than real time (the real
+    latencies of the I/O too, so the lateness of the steps is 'speed' times
+    the real one)"""
+
+    def __init__(self, speed: float = 1000.0, start: float | None = None
+                 ) -> None:
+        """
+        Args:
+            speed (float, optional): virtual seconds in one real second.
+            Defaults to 1000.0.
+            start (float | None, optional): wall clock of the start.
+            Defaults to now.
+        """
+        if speed <= 0:
+            raise ValueError(f"Clock speed must be positive, not {speed}")
+        self.speed = speed
+        self._origin = time.monotonic()
+        self._epoch = time.time() if start is None else start
+
+    def monotonic(self) -> float:
+        return (time.monotonic() - self._origin) * self.speed
+
+    def time(self) -> float:
+        return self._epoch + self.monotonic()
+
+
+class _Sleeper:
+    """Waiter of 'VirtualClock', woken at its deadline by 'wake'"""
+    __slots__ = ("deadline", "wake", "owner", "cond", "done")
+
+    def __init__(self, deadline: float, wake: Callable[[], Any],
+                 owner: Hashable,
+                 cond: threading.Condition | None = None) -> None:
+        self.deadline = deadline
+        self.wake = wake
+        self.owner = owner  # thread or asyncio task
+        self.cond = cond  # condition waited, woken early by 'notify'
+        self.done = False
+
+
+class VirtualClock(Clock):
+    """Virtual time as fast as possible.
+
+    The participants (lanes, sampler, ramp engines) are registered with
+    'enter' and 'leave'. The time jumps to the first deadline only when
+    every participant waits on the clock or is inside 'blocked' (pause,
+    sync point): a participant in a blocking call (pyvisa, modbus, SSH)
+    holds the time, so the steps keep the order and timing of a real run
+    whatever the load of the host. Waits of threads not registered never
+    hold the time.
+    Early wakes are signalled to the clock: a 'ClockEvent' (or any event
+    with 'watch'/'unwatch') set, a condition notified with 'notify'.
+    """
+    speed = math.inf
+
+    def __init__(self, start: float | None = None) -> None:
+        """
+        Args:
+            start (float | None, optional): wall clock of the start.
+            Defaults to now.
+        """
+        self._now = 0.0
+        self._epoch = time.time() if start is None else start
+        self._cond = threading.Condition()
+        self._queue: list[tuple[float, int, _Sleeper]] = []
+        self._counter = itertools.count()
+        self._participants: set[Hashable] = set()
+        self._waiting: Counter[Hashable] = Counter()  # sleepers by owner
+        self._blocked: Counter[Hashable] = Counter()  # 'blocked' depth
+        self._thread: threading.Thread | None = None
+
+    def monotonic(self) -> float:
+        return self._now
+
+    def time(self) -> float:
+        return self._epoch + self._now
+
+    def enter(self, owner: Hashable | None = None):
+        owner = _owner() if owner is None else owner
+        with self._cond:
+            self._participants.add(owner)
+        if isinstance(owner, asyncio.Task):
+            owner.add_done_callback(self.leave)
+
+    def leave(self, owner: Hashable | None = None):
+        owner = _owner() if owner is None else owner
+        with self._cond:
+            self._participants.discard(owner)
+            self._cond.notify()
+
+    @contextmanager
+    def blocked(self) -> Iterator[None]:
+        owner = _owner()
+        with self._cond:
+            self._blocked[owner] += 1
+            self._cond.notify()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._blocked[owner] -= 1
+                if not self._blocked[owner]:
+                    del self._blocked[owner]
+
+    def wait(self, event: threading.Event, timeout: float | None) -> bool:
+        if timeout is None or event.is_set():
+            with self.blocked():
+                return event.wait(timeout)
+        if timeout <= 0:
+            return False
+        woken = threading.Event()
+        sleeper = self._add(timeout, woken.set, _owner())
+        early = partial(self._wake_early, sleeper)
+        watch = getattr(event, "watch", None)
+        if watch is not None:
+            watch(early)
+        try:
+            if event.is_set():
+                early()
+            woken.wait()
+        finally:
+            if watch is not None:
+                event.unwatch(early)
+            self._remove(sleeper)
+        return event.is_set()
+
+    def wait_condition(self, cond: threading.Condition,
+                       timeout: float | None) -> bool:
+        if timeout is not None and timeout <= 0:
+            return False
+
+        def wake():
+            with cond:
+                cond.notify_all()
+
+        sleeper = self._add(math.inf if timeout is None else timeout, wake,
+                            _owner(), cond)
+        try:
+            cond.wait()
+        finally:
+            self._remove(sleeper)
+        return timeout is None or self._now < sleeper.deadline
+
+    def notify(self, cond: threading.Condition):
+        with self._cond:
+            for _, _, sleeper in self._queue:
+                if sleeper.cond is cond:
+                    self._done(sleeper)  # runs until its next wait
+        cond.notify()
+
+    def sleep(self, seconds: float):
+        self.wait(threading.Event(), seconds)
+
+    async def _async_sleep(self, seconds: float, owner: Hashable,
+                           event: Any = None):
+        if seconds <= 0:
+            await asyncio.sleep(0)
+            return
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(_set_result, future)
+
+        sleeper = self._add(seconds, wake, owner)
+        early = partial(self._wake_early, sleeper)
+        watch = getattr(event, "watch", None)
+        if watch is not None:
+            watch(early)
+        try:
+            await future
+        finally:
+            if watch is not None:
+                event.unwatch(early)
+            self._remove(sleeper)
+
+    def _add(self, delay: float, wake: Callable[[], Any], owner: Hashable,
+             cond: threading.Condition | None = None) -> _Sleeper:
+        with self._cond:
+            sleeper = _Sleeper(self._now + delay, wake, owner, cond)
+            heapq.heappush(self._queue,
+                           (sleeper.deadline, next(self._counter), sleeper))
+            self._waiting[owner] += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run,
+                                                name="VirtualClock",
+                                                daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return sleeper
+
+    def _done(self, sleeper: _Sleeper):
+        """Sleeper woken: its owner runs (lock held)"""
+        if not sleeper.done:
+            sleeper.done = True  # removed from the queue by '_due'
+            self._waiting[sleeper.owner] -= 1
+            if not self._waiting[sleeper.owner]:
+                del self._waiting[sleeper.owner]
+
+    def _remove(self, sleeper: _Sleeper):
+        with self._cond:
+            self._done(sleeper)
+            self._cond.notify()
+
+    def _wake_early(self, sleeper: _Sleeper):
+        with self._cond:
+            if sleeper.done:
+                return
+            self._done(sleeper)
+        sleeper.wake()
+
+    def _idle(self) -> bool:
+        """Every participant waits on the clock or is blocked"""
+        return all(owner in self._waiting or owner in self._blocked
+                   for owner in self._participants)
+
+    def _due(self) -> list[_Sleeper]:
+        """Wait the sleepers to wake, advancing the time if all idle"""
+        with self._cond:
+            while True:
+                while self._queue and self._queue[0][2].done:
+                    heapq.heappop(self._queue)
+                if (self._queue and not math.isinf(self._queue[0][0])
+                        and self._idle()):
+                    self._now = max(self._now, self._queue[0][0])
+                    due = []
+                    while (self._queue
+                           and self._queue[0][0] <= self._now):
+                        sleeper = heapq.heappop(self._queue)[2]
+                        if not sleeper.done:
+                            self._done(sleeper)
+                            due.append(sleeper)
+                    if due:
+                        return due
+                self._cond.wait()
+
+    def _run(self):
+        while True:
+            for sleeper in self._due():
+                sleeper.wake()
+
+
+def _owner() -> Hashable:
+    """Task of the running event loop, else the thread"""
+    try:
+        return asyncio.current_task() or threading.current_thread()
+    except RuntimeError:
+        return threading.current_thread()
+
+
+def _set_result(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
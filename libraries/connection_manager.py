@@ -0,0 +1,101 @@
+"""Open all the instruments concurrently"""
+import logging
+import time
+from concurrent.futures import (FIRST_COMPLETED, Future, ThreadPoolExecutor,
+                                wait)
+from functools import partial
+from typing import Any, Callable, NamedTuple
+
+_logger = logging.getLogger(__name__)
+
+
+class ConnectionResult(NamedTuple):
+    """Result of the connection of one instrument"""
+    name: str
+    instrument: Any  # None if not connected
+    error: BaseException | None
+    elapsed: float  # seconds
+
+    @property
+    def connected(self) -> bool:
+        return self.error is None
+
+
+def connect_all(factories: dict[str, Callable[[], Any]],
+                timeout: float | dict[str, float] = 30
+                ) -> dict[str, ConnectionResult]:
+    """Connect every instrument at the same time on a thread pool\n
+    Args:
+        factories (dict[str, Callable[[], Any]]): name -> function that
+        connects and returns the instrument, raising if not possible
+        timeout (float | dict[str, float], optional): seconds to wait for
+        every instrument, or one value by name. Defaults to 30.\n
+    Returns:
+        dict[str, ConnectionResult]: result by name, in the same order
+    """
+    if not factories:
+        return {}
+    if not isinstance(timeout, dict):
+        timeout = dict.fromkeys(factories, timeout)
+    limit = {name: timeout.get(name, 30) for name in factories}
+    start = time.monotonic()
+    results: dict[str, ConnectionResult] = {}
+    executor = ThreadPoolExecutor(max_workers=len(factories),
+                                  thread_name_prefix="connect")
+    try:
+        pending: dict[Future, str] = {
+            executor.submit(factory): name
+            for name, factory in factories.items()
+            }
+        deadline = {name: start + limit[name] for name in factories}
+        while pending:
+            next_deadline = min(deadline[name] for name in pending.values())
+            done, _ = wait(pending, timeout=max(0, next_deadline -
+                                                time.monotonic()),
+                           return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+            for future in done:
+                name = pending.pop(future)
+                error = future.exception()
+                results[name] = ConnectionResult(
+                    name, None if error else future.result(), error,
+                    now - start)
+            for future, name in list(pending.items()):
+                if now >= deadline[name]:
+                    del pending[future]
+                    future.add_done_callback(partial(_close_late, name))
+                    results[name] = ConnectionResult(
+                        name, None,
+                        TimeoutError(f"no answer in {limit[name]} s"),
+                        now - start)
+    finally:
+        # do not wait the instruments in timeout
+        executor.shutdown(wait=False, cancel_futures=True)
+    results = {name: results[name] for name in factories}
+    _logger.info(summary(results))
+    return results
+
+
+def _close_late(name: str, future: Future):
+    """Close an instrument connected after its timeout: nobody uses it"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    instrument = future.result()
+    close = getattr(instrument, "close", None)
+    if close is None:
+        return
+    _logger.warning(f"{name} connected after the timeout, closed")
+    try:
+        close()
+    except Exception:
+        _logger.exception(f"{name} not closed")
+
+
+def summary(results: dict[str, ConnectionResult]) -> str:
+    """One line for every instrument: connected or error"""
+    connected = sum(r.connected for r in results.values())
+    lines = [f"Connection summary ({connected}/{len(results)} connected)"]
+    for r in results.values():
+        state = "connected" if r.connected else f"FAILED: {r.error!r}"
+        lines.append(f"  {r.name:<8} {state} ({r.elapsed:.1f} s)")
+    return "\n".join(lines)
@@ -1,17 +1,27 @@
+import os
+import pickle
 import sys
 import time
+from functools import cache
+from inspect import signature
 from os import path
 from tkinter import messagebox
+from typing import Iterable, Iterator
 
 import pandas as pd
 import yaml
 
 from .Chamber import ACS_Discovery1200
 from .Connection import ARES_COMMAND
+from .loader import COLUMNS, LANE, iter_json_steps, read_command_file
 from .other_SCPI import CHROMA, HP6032A, ITECH, MSO58B
 
 USER_SEQUENCE_DIR = (f"{path.dirname(path.abspath(__package__))}"
                      "/predefine_sequence/")
+SEQUENCE_CACHE_DIR = USER_SEQUENCE_DIR + "__cache__/"
+SEQUENCE_DISK_CACHE = True  # save parsed sequence, skip YAML on next launch
+GUI_ERRORS = True  # False: errors only logged and raised (headless)
+EXPANDED_COLUMNS = COLUMNS + ["Source", "Row"]
 instr_dict = {
     "dc_source": ITECH,
     "ac_source": CHROMA,
@@ -21,31 +31,19 @@ instr_dict = {
     "armxl": ARES_COMMAND,
     "oscilloscope": MSO58B,
     "sleep": ["sleep", "-"],
+    "sync": ["sync"],  # Command: name of the sync point between lanes
     "sequence": USER_SEQUENCE_DIR
     }
+_sequence_cache: dict[str, tuple[tuple[int, int], tuple[tuple, ...]]] = {}
 
 
-def get_data(all_data=False, filename: str = "command.xlsx", logger=None):
-    now = time.time()  # XXX debug read excel
+def get_data(filename: str = "command.xlsx", logger=None) -> pd.DataFrame:
+    now = time.time()
     if filename == "command.xlsx":
         filepath = path.dirname(path.dirname(path.realpath(__file__)))
         filename = f"{filepath}/{filename}"
     try:
-        if filename.endswith(".xlsx"):
-            df = pd.read_excel(
-                        f"{filename}",  # real file
-                        # f"{filepath}/command_debug.xlsx",  # XXX debug, change to real file_name # noqa: E501
-                        engine="openpyxl",
-                        sheet_name="SequenceConfig",
-                        usecols=["Time", "Instrument", "Command", "Argument"],
-                        header=0,
-                        dtype={"Time": int,
-                               "Instrument": str,
-                               "Command": str,
-                               "Argument": str}
-                        )
-        elif filename.endswith(".json"):
-            raise NotImplementedError  # TODO read json
+        df = read_command_file(filename)
         df.Command = df.Command.str.strip()
     except Exception as e:
         title = "Errore lettura FILE EXCEL"
@@ -55,107 +53,221 @@ def get_data(all_data=False, filename: str = "command.xlsx", logger=None):
         show_error(title, message, e)
         sys.exit()
     else:
-        print(time.time()-now)  # XXX debug read excel
         if logger:
+            logger.debug(f"File read in {time.time()-now:.3f} s")
             logger.debug("Checking sequence")
         check_sequence(df, logger)  # check new write test sequence
         if logger:
             logger.debug("Adding basic sequence")
         df = add_sequence(df, logger)  # add base sequence
-        _time = iter(df.Time)
-        instr = iter(df.Instrument)
-        command = iter(df.Command)
-        args = iter(df.Argument)
-        if all_data:
-            return df
-        else:
-            return df, _time, instr, command, args
+        return df
+
+
+def read_sequence(filename: str, logger=None) -> pd.DataFrame:
+    """Same as 'get_data' for any file, raising instead of exiting"""
+    df = read_command_file(filename)
+    df.Command = df.Command.str.strip()
+    check_sequence(df, logger)
+    return add_sequence(df, logger)
+
+
+def stream_sequence(filename: str) -> Iterator[tuple]:
+    """Stream the steps of a JSON or JSON Lines file, with the sequences
+    expanded, without building a DataFrame\n
+    Yields:
+        tuple: (Time, Instrument, Command, Argument, Source, Row)
+    """
+    rows = ((*step, i + 2) for i, step in enumerate(iter_json_steps(filename)))
+    return expand_sequence(rows)
 
 
 def add_sequence(df: pd.DataFrame, logger) -> pd.DataFrame:
+    """Replace every 'Sequence' row with the steps of its YAML file,
+    recursively. Add 'Source' (chain of the included sequences, empty for
+    the command file) and 'Row' (row of the command file) columns. The
+    steps of a sequence are in the 'Lane' of its row"""
     try:
-        sequence_df = df[df.Instrument == "Sequence"].copy()
-        if sequence_df.__len__() == 0:
-            return df
-
-        def f(index, name):
-            path_ = USER_SEQUENCE_DIR + f"{name}.yaml"
-            with open(path_, "r") as f:
-                sq = pd.DataFrame(yaml.safe_load(f))
-            return (index, sq)
-
-        sq_list = [
-            f(x, y) for x, y in zip(sequence_df.index, sequence_df["Command"])
-            ]
-
-        new_df = df.copy()
-        for i, sq_cmd in sq_list[-1::-1]:
-            if i == 0:
-                new_df = pd.concat([sq_cmd, new_df.loc[i+1:]])
-            elif i == df.index[-1]:
-                new_df = pd.concat([new_df.loc[:i-1], sq_cmd])
-            else:
-                new_df = pd.concat([new_df.loc[:i-1], sq_cmd, new_df.loc[i+1:]])
-            new_df = new_df.reset_index(drop=True)
-        
-        # # iter if sequence inside other sequence
-        # add_sequence(new_df, logger)
-        return new_df
-    
+        columns = [df.Time, df.Instrument, df.Command, df.Argument,
+                   df.index + 2]
+        if LANE in df:
+            columns.append(df[LANE])
+        return pd.DataFrame.from_records(
+            list(expand_sequence(zip(*columns))),
+            columns=EXPANDED_COLUMNS + ([LANE] if LANE in df else []))
+
     except Exception as e:
         title = "Base Sequence Error"
         message = "Errore adding SEQUENCE"
         if logger:
             logger.error(message)
         show_error(title, message, e)
-        raise e        
+        raise e
+
+
+def expand_sequence(rows: Iterable[tuple], source: tuple[str, ...] = ()
+                    ) -> Iterator[tuple]:
+    """Expand the sequence in a single pass\n
+    Args:
+        rows (Iterable[tuple]): (Time, Instrument, Command, Argument, Row,
+        ...), the items after Row (e.g. Lane) are copied in the expanded
+        steps
+        source (tuple[str, ...], optional): names of the sequences being
+        expanded, outermost first. Defaults to ().\n
+    Raises:
+        RecursionError: if a sequence includes itself\n
+    Yields:
+        tuple: (Time, Instrument, Command, Argument, Source, Row, ...)
+    """
+    for _time, instr, command, args, *extra in rows:
+        if str(instr).lower() != "sequence":
+            yield (_time, instr, command, args, "/".join(source), *extra)
+            continue
+        name = command.strip()
+        if name in source:
+            raise RecursionError("Sequence include itself: "
+                                 + " -> ".join(source + (name,)))
+        steps = ((*step, *extra) for step in load_sequence(name))
+        yield from expand_sequence(steps, source + (name,))
+
+
+def load_sequence(name: str) -> tuple[tuple, ...]:
+    """Read a predefine sequence. The parsed steps are cached on path and
+    modification time, in memory and (if SEQUENCE_DISK_CACHE) on disk\n
+    Returns:
+        tuple[tuple, ...]: (Time, Instrument, Command, Argument) of every
+        step. Shared, do not modify
+    """
+    path_ = USER_SEQUENCE_DIR + f"{name}.yaml"
+    stat = os.stat(path_)
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _sequence_cache.get(path_)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    steps = _read_disk_cache(name, key) if SEQUENCE_DISK_CACHE else None
+    if steps is None:
+        with open(path_, "r") as f:
+            steps = tuple(tuple(step[col] for col in COLUMNS)
+                          for step in yaml.safe_load(f))
+        if SEQUENCE_DISK_CACHE:
+            _write_disk_cache(name, key, steps)
+    _sequence_cache[path_] = (key, steps)
+    return steps
+
+
+def available_sequences() -> set[str]:
+    """Names of the predefine sequences"""
+    with os.scandir(USER_SEQUENCE_DIR) as it:
+        return {entry.name[:-5] for entry in it
+                if entry.is_file() and entry.name.endswith(".yaml")}
+
+
+def _read_disk_cache(name: str, key: tuple[int, int]
+                     ) -> tuple[tuple, ...] | None:
+    try:
+        with open(f"{SEQUENCE_CACHE_DIR}{name}.pickle", "rb") as f:
+            cache_key, steps = pickle.load(f)
+    except Exception:
+        return None
+    return steps if cache_key == key else None
+
+
+def _write_disk_cache(name: str, key: tuple[int, int],
+                      steps: tuple[tuple, ...]):
+    try:
+        os.makedirs(SEQUENCE_CACHE_DIR, exist_ok=True)
+        tmp = f"{SEQUENCE_CACHE_DIR}{name}.pickle.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump((key, steps), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, f"{SEQUENCE_CACHE_DIR}{name}.pickle")
+    except OSError:
+        pass  # cache is optional
+
+
+@cache
+def command_signatures() -> dict[str, tuple[int, float]]:
+    """Number of argument accepted by every command, built once from the
+    COMMAND list of the instrument classes and from ARES_COMMAND\n
+    Returns:
+        dict[str, tuple[int, float]]: 'instrument.command' -> (min, max).
+        max is 'inf' for *args
+    """
+    table = {}
+    for instr, cls in instr_dict.items():
+        if instr == "armxl":
+            table.update({f"{instr}.{cmd}": (n, n) for cmd, n in cls.items()})
+        elif hasattr(cls, "COMMAND"):
+            for cmd in cls.COMMAND:
+                params = list(signature(getattr(cls, cmd)).parameters.values()
+                              )[1:]  # no self
+                if any(p.kind is p.KEYWORD_ONLY and p.default is p.empty
+                       for p in params):
+                    continue  # not callable from the command file
+                positional = [p for p in params if p.kind in (
+                    p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)]
+                min_ = sum(p.default is p.empty for p in positional)
+                max_ = (float("inf")
+                        if any(p.kind is p.VAR_POSITIONAL for p in params)
+                        else len(positional))
+                table[f"{instr}.{cmd}"] = (min_, max_)
+    return table
 
 
 def check_sequence(df: pd.DataFrame, logger):
+    """Check the whole sequence at once and report every error with the
+    row of the command file"""
     try:
+        rows = pd.Series(df.index + 2, index=df.index)
+        instr = df.Instrument.str.lower()
+        command = df.Command
+        errors = []
         # check time
-        _time = df.Time.copy()
-        assert (_time >= 0).all(), (
-            f"All value in 'Time' must be positive or equal to 0\n"
-            f"Check index {(_time.index[(_time < 0)]+2).tolist()}")
+        bad = df.Time < 0
+        if bad.any():
+            errors.append("All value in 'Time' must be positive or equal to"
+                          f" 0\nCheck index {rows[bad].tolist()}")
         # check instrument
-        instr = df.Instrument.str.lower().copy()
-        instr_check = instr.isin(instr_dict)
-        assert (instr_check).all(), (
-            f"All value in 'Instrument' must be in {list(instr_dict.keys())}\n"
-            f"Check index {(instr.index[~instr_check]+2).tolist()}")
+        known = instr.isin(instr_dict)
+        if not known.all():
+            errors.append("All value in 'Instrument' must be in "
+                          f"{list(instr_dict.keys())}\n"
+                          f"Check index {rows[~known].tolist()}")
         # check command for instrument
-        command = df.Command.copy()
-        command_err = []
-        for i in range(command.__len__()):
-            if instr[i] == "sleep":
-                continue
-            elif instr[i] == "sequence":
-                if not path.exists(USER_SEQUENCE_DIR + f"{command[i]}.yaml"):
-                    command_err.append(i+2)
-            elif instr[i] == "armxl":
-                if command[i] not in instr_dict.get("armxl"):
-                    command_err.append(i+2)
-            elif command[i] not in instr_dict.get(instr[i]).COMMAND:
-                command_err.append(i+2)
-        if len(command_err) > 0:
-            raise AssertionError("Instrument and Command do not match\n"
-                                 f"Check index {command_err}")
+        is_sleep = instr == "sleep"
+        is_sync = instr == "sync"
+        is_sequence = instr == "sequence"
+        signatures = pd.DataFrame.from_dict(command_signatures(),
+                                            orient="index",
+                                            columns=["min", "max"])
+        key = instr + "." + command
+        sig = signatures.reindex(key.to_numpy()).set_index(df.index)
+        bad = (known & ~is_sleep & ~is_sync & ~is_sequence
+               & sig["min"].isna()) | (
+            is_sequence & ~command.isin(available_sequences()))
+        if bad.any():
+            errors.append("Instrument and Command do not match\n"
+                          f"Check index {rows[bad].tolist()}")
         # check argument lenght for command
-        args = df.Argument.copy()
-        args_err = []
-        for i in range(args.__len__()):
-            if instr[i] in ["sleep", "sequence"]:
-                continue
-            len_args = len(args[i].split()) if args[i] != "-" else 0
-            if instr[i] == "armxl":
-                if len_args != instr_dict.get("armxl")[command[i]]:
-                    args_err.append(i+2)
-                continue
-            f = getattr(instr_dict.get(instr[i]), command[i])
-            len_d = len(f.__defaults__) if f.__defaults__ is not None else 0
-            if not f.__code__.co_argcount - len_d - 1 <= len_args <= f.__code__.co_argcount - 1:
-                args_err.append(i+2)
+        args = df.Argument.fillna("-")
+        n_args = args.str.split().str.len().where(args != "-", 0)
+        bad = (n_args < sig["min"]) | (n_args > sig["max"])
+        for name, group in rows[bad].groupby(key[bad], sort=False):
+            min_, max_ = signatures.loc[name]
+            expected = (f"{min_:.0f}" if min_ == max_
+                        else f"{min_:.0f}-{max_:.0f}")
+            errors.append(f"'{name}' needs {expected} argument\n"
+                          f"Check index {group.tolist()}")
+        # check sync point: only with lanes, once for lane
+        if is_sync.any() and LANE not in df:
+            errors.append("'Sync' needs the 'Lane' column\n"
+                          f"Check index {rows[is_sync].tolist()}")
+        elif is_sync.any():
+            sync = df.loc[is_sync, ["Command", LANE]]
+            bad = sync.index[sync.duplicated(keep=False)]
+            if len(bad):
+                errors.append("'Sync' can be used once for lane\n"
+                              f"Check index {rows[bad].tolist()}")
+        if errors:
+            raise AssertionError("\n".join(errors))
 
     except Exception as e:
         title = "Errore FILE"
@@ -164,22 +276,70 @@ def check_sequence(df: pd.DataFrame, logger):
             logger.error(message)
         show_error(title, message, e)
         raise e
-    # TODO creare dizionario strumento, comando, tipo parametro e fare check
-    # df.v.apply(float.is_integer).all()
-    pass
 
 
-def show_error(title: str, message: str, e: Exception):
-    messagebox.showerror(title, message + f"\n{str(e)}")
+def check_stream(filename: str, logger):
+    """Same checks of 'check_sequence' on a JSON or JSON Lines file, in a
+    single pass with constant memory (only the rows with errors are kept),
+    before the instruments are connected"""
+    try:
+        signatures = command_signatures()
+        sequences = available_sequences()
+        errors: dict[tuple[int, str], list[int]] = {}  # -> rows
+        for i, step in enumerate(iter_json_steps(filename)):
+            for error in _step_errors(*step, signatures, sequences):
+                errors.setdefault(error, []).append(i + 2)
+        if errors:
+            # same order of 'check_sequence'
+            raise AssertionError("\n".join(
+                f"{error}\nCheck index {rows}"
+                for (_, error), rows in sorted(errors.items(),
+                                               key=lambda e: e[0][0])))
+
+    except Exception as e:
+        title = "Errore FILE"
+        message = "Errore colonne del file di comando"
+        if logger:
+            logger.error(message)
+        show_error(title, message, e)
+        raise e
+
 
+def _step_errors(_time, instr: str, command: str, args: str,
+                 signatures: dict[str, tuple[int, float]],
+                 sequences: set[str]) -> Iterator[tuple[int, str]]:
+    """Errors of one step: (check, message of 'check_sequence')"""
+    instr, command = str(instr).lower(), str(command).strip()
+    if _time < 0:
+        yield 0, "All value in 'Time' must be positive or equal to 0"
+    if instr not in instr_dict:
+        yield 1, ("All value in 'Instrument' must be in "
+                  f"{list(instr_dict.keys())}")
+        return
+    if instr == "sync":
+        yield 4, "'Sync' needs the 'Lane' column"  # lanes are not streamed
+        return
+    if instr == "sequence":
+        if command not in sequences:
+            yield 2, "Instrument and Command do not match"
+        return
+    if instr == "sleep":
+        return
+    name = f"{instr}.{command}"
+    if name not in signatures:
+        yield 2, "Instrument and Command do not match"
+        return
+    min_, max_ = signatures[name]
+    n_args = 0 if args == "-" else len(args.split())
+    if not min_ <= n_args <= max_:
+        expected = (f"{min_:.0f}" if min_ == max_
+                    else f"{min_:.0f}-{max_:.0f}")
+        yield 3, f"'{name}' needs {expected} argument"
 
-def to_json(df):
-    return
-    with open("sample.json", "w") as outfile:
-        # sample_records
-        df.to_json(outfile, orient='records', indent=4)
-        # records value
-        df.to_json(outfile, orient='values', indent=4)
+
+def show_error(title: str, message: str, e: Exception):
+    if GUI_ERRORS:
+        messagebox.showerror(title, message + f"\n{str(e)}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,281 @@
+"""Read command files (xlsx, csv, json) with an automatic binary cache"""
+import json
+import os
+from os import path
+from functools import partial
+from typing import IO, Any, Callable, Iterator
+
+import numpy as np
+import pandas as pd
+
+SHEET_NAME = "SequenceConfig"
+COLUMNS = ["Time", "Instrument", "Command", "Argument"]
+LANE = "Lane"  # optional column, independent timeline for every lane
+DEFAULT_LANE = ""
+DTYPES = {"Time": int,
+          "Instrument": str,
+          "Command": str,
+          "Argument": str}
+CACHE_DIR = "__cache__"  # created next to the command file
+SCHEMA_FILE = path.join(path.dirname(path.abspath(__file__)),
+                        "sequence.schema.json")
+JSON_CHUNK = 1 << 16  # bytes read at a time from a JSON file
+
+
+def read_command_file(filename: str, use_cache: bool = True
+                      ) -> pd.DataFrame:
+    """Read the 'SequenceConfig' columns of a command file\n
+    Args:
+        filename (str): .xlsx, .xlsm, .csv, .json, .jsonl or .npz (cache)
+        file
+        use_cache (bool, optional): read and update the .npz cache of the
+        file, regenerated when the file changes. Defaults to True.\n
+    Raises:
+        NotImplementedError: if the format is not supported\n
+    Returns:
+        pd.DataFrame: Time, Instrument, Command, Argument (+ Lane if present)
+    """
+    ext = path.splitext(filename)[1].lower()
+    if ext in (".xlsx", ".xlsm"):
+        reader = _read_xlsx
+    elif ext == ".csv":
+        reader = _read_csv
+    elif ext in (".json", ".jsonl"):
+        reader = _read_json
+    elif ext == ".npz":
+        return _read_npz(filename)[1]
+    else:
+        raise NotImplementedError(f"Formato '{ext}' non supportato")
+    if not use_cache:
+        return reader(filename)
+
+    stat = os.stat(filename)
+    key = np.array([stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+    cache = cache_path(filename)
+    try:
+        cache_key, df = _read_npz(cache)
+        if np.array_equal(cache_key, key):
+            return df
+    except (OSError, KeyError, ValueError):
+        pass
+    df = reader(filename)
+    try:
+        _write_npz(cache, key, df)
+    except OSError:
+        pass  # cache is optional
+    return df
+
+
+def cache_path(filename: str) -> str:
+    """Path of the binary cache of the command file"""
+    folder, name = path.split(path.abspath(filename))
+    return path.join(folder, CACHE_DIR, f"{name}.npz")
+
+
+def _read_xlsx(filename: str) -> pd.DataFrame:
+    """Stream the sheet with a read-only workbook"""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(filename, read_only=True, data_only=True)
+    try:
+        rows = wb[SHEET_NAME].iter_rows(values_only=True)
+        header = list(next(rows))
+        columns = COLUMNS + ([LANE] if LANE in header else [])
+        index = [header.index(col) for col in columns]
+        data = [[row[i] if i < len(row) else None for i in index]
+                for row in rows if any(v is not None for v in row)]
+    finally:
+        wb.close()
+    df = pd.DataFrame(data, columns=columns)
+    df.Time = df.Time.astype(int)
+    for col in columns[1:]:
+        df[col] = df[col].map(str, na_action="ignore").astype(object)
+    return _fill_lane(df)
+
+
+def _read_csv(filename: str) -> pd.DataFrame:
+    df = pd.read_csv(filename, usecols=lambda col: col in COLUMNS + [LANE],
+                     dtype={**DTYPES, LANE: str})
+    return _fill_lane(df[[col for col in COLUMNS + [LANE] if col in df]])
+
+
+def _read_json(filename: str) -> pd.DataFrame:
+    df = pd.DataFrame.from_records(list(iter_json_steps(filename, True)),
+                                   columns=COLUMNS + [LANE])
+    if (df[LANE] == DEFAULT_LANE).all():
+        df = df.drop(columns=LANE)
+    return df
+
+
+def _fill_lane(df: pd.DataFrame) -> pd.DataFrame:
+    """Empty cell of 'Lane' are in the default lane"""
+    if LANE in df:
+        df[LANE] = df[LANE].fillna(DEFAULT_LANE).astype(str).str.strip()
+    return df
+
+
+def iter_json_steps(filename: str, lanes: bool = False) -> Iterator[tuple]:
+    """Parse a JSON (array of step) or JSON Lines (one step for line) file
+    incrementally, validating every step against the sequence schema\n
+    Args:
+        filename (str): .json or .jsonl file
+        lanes (bool, optional): yield also the lane of the step. Defaults
+        to False.\n
+    Raises:
+        ValueError: if a step is not valid, or has a lane and 'lanes' is
+        False\n
+    Yields:
+        tuple: (Time, Instrument, Command, Argument[, Lane])
+    """
+    validate = _step_validator()
+    with open(filename, "r", encoding="utf-8") as f:
+        if filename.lower().endswith(".jsonl"):
+            items = (json.loads(line) for line in f if line.strip())
+        else:
+            items = _iter_json_array(f)
+        for i, item in enumerate(items):
+            error = validate(item)
+            if error:
+                raise ValueError(f"Step {i}: {error}")
+            args = item.get("Argument", "-")
+            step = (item["Time"], item["Instrument"], item["Command"],
+                    str(args) if args is not None else "-")
+            lane = str(item.get(LANE, DEFAULT_LANE))
+            if lanes:
+                yield (*step, lane)
+            elif lane != DEFAULT_LANE:
+                raise ValueError(f"Step {i}: '{LANE}' needs the whole "
+                                 "sequence, not supported here")
+            else:
+                yield step
+
+
+def _iter_json_array(f: IO[str]) -> Iterator:
+    """Yield the items of a top-level JSON array without loading the file"""
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    def skip(chars: str):
+        nonlocal buf, pos, eof
+        while True:
+            while pos < len(buf) and buf[pos] in chars:
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            buf, pos = f.read(JSON_CHUNK), 0
+            eof = not buf
+
+    skip(" \t\r\n")
+    if buf[pos:pos+1] != "[":
+        raise ValueError("JSON sequence must be an array of step")
+    pos += 1
+    first = True
+    while True:
+        skip(" \t\r\n")
+        if buf[pos:pos+1] == "]":
+            return
+        if not first:
+            if buf[pos:pos+1] != ",":
+                raise ValueError("Expected ',' or ']' near "
+                                 f"'{buf[pos:pos+20]}'")
+            pos += 1
+            skip(" \t\r\n")
+        while True:
+            try:
+                item, pos = decoder.raw_decode(buf, pos)
+                break
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                more = f.read(JSON_CHUNK)
+                eof = not more
+                buf, pos = buf[pos:] + more, 0
+        first = False
+        yield item
+
+
+def _step_validator() -> Callable[[Any], str | None]:
+    """Validator of a single step, built once from the schema file.
+    Use 'jsonschema' if installed, a minimal check otherwise"""
+    global _validate_step
+    if _validate_step is None:
+        with open(SCHEMA_FILE, "r", encoding="utf-8") as f:
+            step_schema = json.load(f)["definitions"]["step"]
+        try:
+            from jsonschema import Draft7Validator
+        except ImportError:
+            _validate_step = partial(_check_step, schema=step_schema)
+        else:
+            _validate_step = partial(_first_error,
+                                     Draft7Validator(step_schema))
+    return _validate_step
+
+
+_validate_step: Callable[[Any], str | None] | None = None
+_JSON_TYPES = {"object": (dict,), "string": (str,), "null": (type(None),),
+               "number": (int, float), "integer": (int,)}
+
+
+def _first_error(validator, item) -> str | None:
+    error = next(validator.iter_errors(item), None)
+    return error.message if error else None
+
+
+def _check_step(item, schema: dict) -> str | None:
+    """Minimal schema check: type, required, properties type and minimum,
+    additionalProperties"""
+    if not isinstance(item, dict):
+        return f"{item!r} is not of type 'object'"
+    for key in schema.get("required", []):
+        if key not in item:
+            return f"'{key}' is a required property"
+    properties = schema.get("properties", {})
+    for key, value in item.items():
+        if key not in properties:
+            if schema.get("additionalProperties", True) is False:
+                return f"Additional properties are not allowed ('{key}')"
+            continue
+        types = properties[key].get("type", [])
+        types = [types] if isinstance(types, str) else types
+        allowed = tuple(t for name in types for t in _JSON_TYPES[name])
+        if types and (isinstance(value, bool)
+                      or not isinstance(value, allowed)):
+            return f"{value!r} is not of type {types}"
+        minimum = properties[key].get("minimum")
+        if minimum is not None and value < minimum:
+            return f"{value!r} is less than the minimum of {minimum}"
+    return None
+
+
+def to_json(df: pd.DataFrame, filename: str, lines: bool = False):
+    """Write the sequence as JSON (array of step) or JSON Lines"""
+    columns = COLUMNS + ([LANE] if LANE in df else [])
+    records = df[columns].to_dict(orient="records")
+    with open(filename, "w", encoding="utf-8") as f:
+        if lines:
+            for record in records:
+                f.write(json.dumps(record, default=str) + "\n")
+        else:
+            json.dump(records, f, indent=4, default=str)
+
+
+def _write_npz(filename: str, key: np.ndarray, df: pd.DataFrame):
+    os.makedirs(path.dirname(filename), exist_ok=True)
+    arrays = {"key": key, "Time": df.Time.to_numpy(dtype=np.int64)}
+    for col in COLUMNS[1:] + ([LANE] if LANE in df else []):
+        na = df[col].isna().to_numpy()
+        arrays[col] = df[col].fillna("").to_numpy(dtype=str)
+        arrays[f"{col}_na"] = na
+    tmp = f"{filename}.tmp.npz"
+    np.savez(tmp, **arrays)
+    os.replace(tmp, filename)
+
+
+def _read_npz(filename: str) -> tuple[np.ndarray, pd.DataFrame]:
+    with np.load(filename, allow_pickle=False) as data:
+        df = pd.DataFrame({"Time": data["Time"]})
+        for col in COLUMNS[1:] + ([LANE] if LANE in data else []):
+            values = data[col].astype(object)
+            values[data[f"{col}_na"]] = np.nan
+            df[col] = values
+        return data["key"], df
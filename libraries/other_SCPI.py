@@ -1,23 +1,113 @@
 import datetime
 import logging
-import time
-from typing import Callable, Iterable, Literal, Type, Union
+import re
+import threading
+from collections import Counter
+from typing import Callable, Literal, Type, Union
 
 import numpy as np
 import pyvisa
 
+from . import ramp
+
 _logger = logging.getLogger()
 
 
+class ResourcePool:
+    """Process-wide pyvisa ResourceManager with the opened resources cached
+    by address. Reconnecting an instrument reuses its open session, closed
+    when the last instrument using it releases it"""
+
+    def __init__(self, visa_library: str = "") -> None:
+        self.visa_library = visa_library  # e.g. '@py', '<profile>@sim'
+        # visa_library -> ResourceManager, e.g. the in-process simulation
+        self.factory: Callable[[str], pyvisa.ResourceManager] = \
+            pyvisa.ResourceManager
+        self._rm: pyvisa.ResourceManager | None = None
+        self._resources: dict[str, pyvisa.resources.MessageBasedResource] = {}
+        self._locks: dict[str, threading.Lock] = {}
+        self._users: Counter[str] = Counter()  # instruments by address
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._resources)
+
+    @property
+    def resource_manager(self) -> pyvisa.ResourceManager:
+        """The shared ResourceManager, created on first use"""
+        with self._lock:
+            if self._rm is None:
+                self._rm = self.factory(self.visa_library)
+            return self._rm
+
+    def open_resource(self, address: str, **kwargs
+                      ) -> pyvisa.resources.MessageBasedResource:
+        """Return the open session of the address, or open a new one.
+        Every call must be paired with 'release_resource'"""
+        rm = self.resource_manager
+        with self._lock:
+            lock = self._locks.setdefault(address, threading.Lock())
+        with lock:  # same address opened once, others in parallel
+            resource = self._resources.get(address)
+            if resource is not None and self._is_open(resource):
+                _logger.debug(f"reuse session of {address}")
+            else:
+                resource = rm.open_resource(address, **kwargs)
+                self._resources[address] = resource
+            with self._lock:
+                self._users[address] += 1
+            return resource
+
+    def release_resource(self, address: str):
+        """One instrument no longer uses the session of the address: closed
+        with the last one"""
+        with self._lock:
+            if self._users[address] > 1:
+                self._users[address] -= 1
+                return
+        self.close_resource(address)
+
+    def close_resource(self, address: str):
+        """Close the session of the address and remove it from the pool,
+        even if other instruments use it"""
+        with self._lock:
+            self._users.pop(address, None)
+        resource = self._resources.pop(address, None)
+        if resource is not None and self._is_open(resource):
+            resource.close()
+
+    def close_all(self):
+        """Close all the sessions and the ResourceManager"""
+        for address in list(self._resources):
+            self.close_resource(address)
+        with self._lock:
+            if self._rm is not None:
+                self._rm.close()
+                self._rm = None
+
+    @staticmethod
+    def _is_open(resource) -> bool:
+        try:
+            resource.session
+        except pyvisa.errors.InvalidSession:
+            return False
+        return True
+
+
+resource_pool = ResourcePool()
+
+
 class Instrument:
     # FIXME Potrei sostituire tutti i self._instrument.write con self.write_command. Idem per query e read # noqa: E501
     """Generic Instrument Class"""
 
     def __init__(self) -> None:
         self._instrument: pyvisa.resources.MessageBasedResource = None
+        self.address: str | None = None
         self.alias = None
         self.nameid = None
         self.connection = False
+        self.lock = threading.RLock()  # un solo comando alla volta
 
     def __str__(self) -> str:
         return f"Instr: {self._instrument}"
@@ -28,8 +118,11 @@ class Instrument:
             id_string (str): stringa di connessione strumento
             (GPIB, USB, TCPIP, ...)"""
         try:
-            self._instrument = pyvisa.ResourceManager(
-                ).open_resource(id_string)
+            resource = resource_pool.open_resource(id_string)
+            if self.connection:  # riconnessione: rilascia la precedente
+                resource_pool.release_resource(self.address)
+            self._instrument = resource
+            self.address = id_string
             self.connection = True
             _logger.debug(f"instrument at {id_string} connected")
             return True, None
@@ -78,8 +171,11 @@ class Instrument:
         raise NotImplementedError("Comando da sovrascrivere")
 
     def close(self):
-        """Chiude la connessione con lo strumento"""
-        self._instrument.close()
+        """Chiude la connessione con lo strumento (la sessione resta aperta
+        se usata da altri strumenti)"""
+        if self.connection:
+            resource_pool.release_resource(self.address)
+        self.connection = False
         _logger.debug(f"Closed {self._instrument}")
 
     def get_idn(self):
@@ -221,6 +317,7 @@ class ITECH(Instrument):
         'mode': ('fixed', 'list', 'battery', 'solar', 'carprofile'),
     }
     TIMESTEP = 0.5
+    DATA_OUTPUT = ["ITECH_V", "ITECH_I", "ITECH_P"]
 
     def __init__(self, setup: dict = {}, dataconfig: dict = {}):
         super().__init__()
@@ -291,34 +388,32 @@ class ITECH(Instrument):
     def set_mode(self, value: str = 'fixed'):
         self._instrument.write(f"FUNCtion:MODE {value}")
 
-    def __gradient_setpoint(self, target: Callable,
-                            values: Iterable, timer: float):  # VERIFY gradient
-        start = time.time()
-        for i in range(len(values)-1):
-            now = time.time()
-            target(values[i+1])
-            while (time.time() <= (now + self.TIMESTEP) and
-                   (time.time() - start) < timer):
-                continue
+    def __gradient_setpoint(self, command: Literal["CURRent", "VOLTage"],
+                            start_value: float, final_value: float,
+                            timer: float):
+        """Rampa da start_value a final_value in 'timer' secondi, un
+        setpoint ogni TIMESTEP sulla timeline del motore di rampa condiviso
+        """
+        if start_value == final_value:
+            values = [final_value]
+        else:
+            step = (final_value - start_value) / (timer / self.TIMESTEP)
+            values = np.arange(start_value, final_value, step).tolist()[1:]
+            values.append(final_value)
+        ramp.ramp_engine.start_ramp(
+            (self, command),
+            lambda value: self._instrument.write(f"{command} {value}"),
+            values, self.TIMESTEP, lock=self.lock)
 
     # # --- cc mode --- # #
     def set_current(self, value: int | float,
                     time_to_set_s: None | float = None):  # VERIFY time_to_set
-        if time_to_set_s:
-            if time_to_set_s <= 1:  # condition to set immediate final value
-                self._instrument.write(f'CURRent {value}')
-            else:
-                import threading
-
-                assert isinstance(time_to_set_s, float | int)
-                start_value = self._instrument.query_ascii_values("CURR?")
-                target_ = self.set_current
-                step = (value - start_value[0]) / (time_to_set_s / self.TIMESTEP)
-                values = np.arange(start_value[0], value, step).tolist() + [value]
-                t = threading.Thread(target=self.__gradient_setpoint,
-                                     args=(target_, values, time_to_set_s),
-                                     daemon=True)
-                t.start()
+        ramp.ramp_engine.cancel((self, "CURRent"))  # new setpoint, stop ramp
+        if time_to_set_s and time_to_set_s > 1:  # else immediate final value
+            assert isinstance(time_to_set_s, float | int)
+            start_value = self._instrument.query_ascii_values("CURR?")
+            self.__gradient_setpoint("CURRent", start_value[0], value,
+                                     time_to_set_s)
         else:
             self._instrument.write(f'CURRent {value}')
 
@@ -332,21 +427,12 @@ class ITECH(Instrument):
 
     # # --- cv mode --- # #
     def set_voltage(self, value: int | float, time_to_set_s: None | int = None):  # VERIFY time_to_set_s # noqa: E501
-        if time_to_set_s:
-            if time_to_set_s <= 1:  # condition to set immediate final value
-                self._instrument.write(f'CURRent {value}')
-            else:
-                import threading
-
-                assert isinstance(time_to_set_s, float | int)
-                start_value = self._instrument.query_ascii_values("VOLT?")
-                target_ = self.set_voltage
-                step = (value - start_value) / (time_to_set_s / self.TIMESTEP)
-                values = np.arange(start_value, value, step).tolist() + [value]
-                t = threading.Thread(target=self.__gradient_setpoint,
-                                     args=(target_, values, time_to_set_s),
-                                     daemon=True)
-                t.start()
+        ramp.ramp_engine.cancel((self, "VOLTage"))  # new setpoint, stop ramp
+        if time_to_set_s and time_to_set_s > 1:  # else immediate final value
+            assert isinstance(time_to_set_s, float | int)
+            start_value = self._instrument.query_ascii_values("VOLT?")
+            self.__gradient_setpoint("VOLTage", start_value[0], value,
+                                     time_to_set_s)
         else:
             self._instrument.write(f'VOLTage {value}')
 
@@ -364,9 +450,16 @@ class ITECH(Instrument):
     # ----- setup and reading ----- #
     def read_measure(self) -> tuple[str, str, str]:
         # v, c, p, _, _ = self._instrument.query("MEASure:SCALar?")
-        v, c, p, _, _ = self._instrument.query("FETch:SCALar?")
+        v, c, p, _, _ = self._instrument.query("FETch:SCALar?").split(",")
         return v, c, p
 
+    def get_data(self) -> list[float]:
+        """Legge tensione, corrente e potenza\n
+        Returns:
+            list[float]: valori in ordine di DATA_OUTPUT
+        """
+        return [float(i) for i in self.read_measure()]
+
     # def set_setup(self, setup:dict): # NEW FEATURE tutte impostazioni setup ITECH
     #   """Impostazioni di setup\n
     #   Args:
@@ -400,6 +493,13 @@ class CHROMA(Instrument):
         **dict.fromkeys(("apparent", "apparente", "S"), "apparent"),
         **dict.fromkeys(("reactive", "reattiva", "Q"), "reactive"),
     }
+    PHASES = (1, 2, 3)
+    STATUS_QUERY = ("FETCH:FREQ?", "FETCH:VOLTAGE:ACDC?",
+                    "FETCH:CURRENT:ACDC?", "FETCH:POWER:AC?",
+                    "FETCH:POWER:AC:PFAC?")
+    STATUS_SINGLE_MESSAGE = True  # False: una query per fase
+    DATA_OUTPUT = [f"CHROMA_{meas}_L{i}"
+                   for meas in ("F", "V", "I", "P", "PF") for i in (1, 2, 3)]
 
     def __init__(self, setup: dict = {}, dataconfig: dict = {}):
         super().__init__()
@@ -493,30 +593,55 @@ class CHROMA(Instrument):
         return out
 
     def status_measure(self):
-        frequency = []
-        voltage = []
-        current = []
-        power = []
-        pf = []
-        for i in range(1, 4):
-            self._instrument.write(f"INSTR:NSEL {i}")
-            out = self._instrument.query_ascii_values("FETCH:FREQ?")
-            frequency.append(out)
-            out = self._instrument.query_ascii_values("FETCH:VOLTAGE:ACDC?")
-            voltage.append(out)
-            out = self._instrument.query_ascii_values("FETCH:CURRENT:ACDC?")
-            current.append(out)
-            out = self._instrument.query_ascii_values("FETCH:POWER:AC?")
-            power.append(out)
-            out = self._instrument.query_ascii_values("FETCH:POWER:AC:PFAC?")
-            pf.append(out)
-        return frequency, voltage, current, power, pf
+        """Misure di stato delle tre fasi, come liste per misura\n
+        Returns:
+            tuple[list, ...]: frequency, voltage, current, power, pf. Per
+            ognuna una lista [valore] per fase
+        """
+        status = self.status_array()
+        return tuple(meas[:, None].tolist() for meas in status.T)
+
+    def status_array(self, single_message: bool | None = None
+                     ) -> np.ndarray:
+        """Legge le misure di stato con una query SCPI concatenata (';')
+        per fase, o una sola per tutte le fasi\n
+        Args:
+            single_message (bool | None, optional): una sola query per le tre
+            fasi. Defaults to STATUS_SINGLE_MESSAGE.\n
+        Raises:
+            ValueError: se la risposta non contiene tutte le misure\n
+        Returns:
+            np.ndarray: shape (fasi, misure), misure in ordine di
+            STATUS_QUERY
+        """
+        if single_message is None:
+            single_message = self.STATUS_SINGLE_MESSAGE
+        fetch = ";:".join(self.STATUS_QUERY)
+        messages = [f"INSTR:NSEL {i};:{fetch}" for i in self.PHASES]
+        if single_message:
+            messages = [";:".join(messages)]
+        replies = [self._instrument.query(message) for message in messages]
+        values = np.array(re.split(r"[;,]", ";".join(replies).strip()),
+                          dtype=float)
+        shape = (len(self.PHASES), len(self.STATUS_QUERY))
+        if values.size != shape[0] * shape[1]:
+            raise ValueError(f"Risposta con {values.size} valori invece di "
+                             f"{shape[0] * shape[1]}: {replies!r}")
+        return values.reshape(shape)
+
+    def get_data(self) -> list[float]:
+        """Legge le misure di stato delle tre fasi\n
+        Returns:
+            list[float]: valori in ordine di DATA_OUTPUT
+        """
+        return self.status_array().T.ravel().tolist()
 
     COMMAND = ["set_output", "set_frequency", "set_voltage",
                "europe_grid", "usa_grid"]
 
 
 class HP6032A(Instrument):
+    DATA_OUTPUT = ["HP6032A_V", "HP6032A_I"]
 
     def __init__(self, setup: dict = {}, dataconfig: dict = {}) -> None:
         super().__init__()
@@ -593,6 +718,14 @@ class HP6032A(Instrument):
         else:
             raise KeyError("misura non disponibile\nSeleziona tra"
                            " 'current' o 'voltage'")
+
+    def get_data(self) -> list[float]:
+        """Legge tensione e corrente\n
+        Returns:
+            list[float]: valori in ordine di DATA_OUTPUT
+        """
+        return [float(self.read_measure("voltage")),
+                float(self.read_measure("current"))]
     # ----- all COMMAND -----#
     COMMAND = ["set_output", "set_current", "set_voltage"]
 
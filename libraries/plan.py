@@ -0,0 +1,203 @@
+"""Compile a command sequence into an execution plan of pre-resolved steps"""
+import ast
+from types import NoneType
+from typing import Any, Callable, Iterable, Iterator, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from .loader import DEFAULT_LANE, LANE
+
+
+class Step(NamedTuple):
+    """Pre-resolved step of the sequence"""
+    index: int
+    instrument: str  # instrument name, lower case
+    target: str  # instrument description for the info box
+    label: str  # command description for the info box
+    func: Callable | None  # bound method, None for sleep
+    args: tuple
+    offset: float  # planned start, seconds from sequence start
+    time: float  # wait after the command
+    lane: str = DEFAULT_LANE  # timeline of the step
+
+
+def arg_parse(arg_str):
+    """Parsing argument from str type"""
+    if isinstance(arg_str, pd._libs.missing.NAType | NoneType):
+        return None
+    elif arg_str == "":
+        return None
+    elif arg_str == "-":
+        return None
+    elif isinstance(arg_str, int) or isinstance(arg_str, float):
+        return [arg_str]
+    else:
+        args = [i.split() if len(i.split()) > 1 else i
+                for i in arg_str.split()]
+
+    def tryeval(val):
+        if isinstance(val, Iterable) and not isinstance(val, str):
+            val = [tryeval(i) for i in val]
+        try:
+            val = ast.literal_eval(val)
+        except ValueError:
+            pass
+        return val
+
+    args = [tryeval(i) for i in args]
+    return args
+
+
+def compile_plan(df: pd.DataFrame, instruments: dict[str, Any]
+                 ) -> tuple[Step, ...]:
+    """Resolve instrument, method and arguments of every step once\n
+    Args:
+        df (pd.DataFrame): sequence with Time, Instrument, Command, Argument
+        and optional Lane
+        instruments (dict[str, Any]): connected instrument by lower name\n
+    Raises:
+        ValueError: if a step uses an instrument not connected, or the sync
+        points of the lanes can not be reached\n
+    Returns:
+        tuple[Step, ...]: steps in file order, 'split_lanes' to group them
+    """
+    connected = [name for name, instr in instruments.items()
+                 if instr is not None] + ["sync"]
+    not_connected = np.flatnonzero(~df.Instrument.str.lower().isin(connected))
+    if len(not_connected):
+        raise ValueError("Instrument not connected\n"
+                         f"Check index {not_connected.tolist()}")
+    rows = zip(df.Time, df.Instrument, df.Command, df.Argument)
+    if LANE not in df:
+        return tuple(iter_plan(rows, instruments))
+    offsets = lane_offsets(df.Time, df.Instrument.str.lower(), df.Command,
+                           df[LANE])
+    return tuple(iter_plan(rows, instruments, zip(df[LANE], offsets)))
+
+
+def lane_offsets(times: Iterable[float], instruments: Iterable[str],
+                 commands: Iterable[str], lanes: Iterable[str]
+                 ) -> list[float]:
+    """Planned offset of every step. Every lane has its own timeline; a
+    'sync' step starts when the last of its lanes reaches it\n
+    Raises:
+        ValueError: if the sync points are in a different order in two
+        lanes\n
+    Returns:
+        list[float]: offset of every step, in the same order
+    """
+    times, lanes = list(times), list(lanes)
+    sync = [command if instr == "sync" else None
+            for instr, command in zip(instruments, commands)]
+    rows: dict[str, list[int]] = {}
+    members: dict[str, set[str]] = {}
+    for i, lane in enumerate(lanes):
+        rows.setdefault(lane, []).append(i)
+        if sync[i] is not None:
+            members.setdefault(sync[i], set()).add(lane)
+    offsets: list[float] = [0.0] * len(times)
+    cursor = dict.fromkeys(rows, 0.0)
+    pos = dict.fromkeys(rows, 0)
+    changed = True
+    while changed:
+        changed = False
+        waiting: dict[str, list[str]] = {}
+        for lane, index in rows.items():
+            while pos[lane] < len(index) and sync[index[pos[lane]]] is None:
+                i = index[pos[lane]]
+                offsets[i] = cursor[lane]
+                cursor[lane] += times[i]
+                pos[lane] += 1
+            if pos[lane] < len(index):
+                waiting.setdefault(sync[index[pos[lane]]], []).append(lane)
+        for name, reached in waiting.items():
+            if set(reached) != members[name]:
+                continue
+            offset = max(cursor[lane] for lane in reached)
+            for lane in reached:
+                i = rows[lane][pos[lane]]
+                offsets[i] = offset
+                cursor[lane] = offset + times[i]
+                pos[lane] += 1
+            changed = True
+    blocked = {lane: sync[index[pos[lane]]] for lane, index in rows.items()
+               if pos[lane] < len(index)}
+    if blocked:
+        raise ValueError(f"Sync points never reached, lane: sync {blocked}")
+    return offsets
+
+
+def split_lanes(plan: Iterable[Step]) -> dict[str, list[Step]]:
+    """Steps of every lane, in order of first appearance"""
+    lanes: dict[str, list[Step]] = {}
+    for step in plan:
+        lanes.setdefault(step.lane, []).append(step)
+    return lanes
+
+
+def sync_parties(plan: Iterable[Step]) -> dict[str, int]:
+    """Number of lanes that wait every sync point"""
+    parties: dict[str, int] = {}
+    for step in plan:
+        if step.instrument == "sync":
+            parties[step.args[0]] = parties.get(step.args[0], 0) + 1
+    return parties
+
+
+def iter_plan(rows: Iterable[tuple], instruments: dict[str, Any],
+              timeline: Iterable[tuple[str, float]] | None = None
+              ) -> Iterator[Step]:
+    """Resolve the steps one at a time, e.g. from a streamed sequence\n
+    Args:
+        rows (Iterable[tuple]): (Time, Instrument, Command, Argument, ...)
+        instruments (dict[str, Any]): connected instrument by lower name
+        timeline (Iterable[tuple[str, float]] | None, optional): (Lane,
+        offset) of every step, see 'lane_offsets'. Defaults to a single
+        lane, one step after the other.\n
+    Raises:
+        ValueError: if a step uses an instrument not connected\n
+    Yields:
+        Step: steps in execution order
+    """
+    resolved: dict[tuple, tuple[str, str, Callable | None, tuple]] = {}
+    offset = 0
+    lane = DEFAULT_LANE
+    timeline = iter(timeline) if timeline is not None else None
+    for i, (_time, instr_name, command, argument, *_) in enumerate(rows):
+        if timeline is not None:
+            lane, offset = next(timeline)
+        instr_name = instr_name.lower()
+        if instr_name == "sleep":
+            step = ("sleep", f"Wait {_time} seconds ", None, ())
+        elif instr_name == "sync":
+            step = ("sync", f"Sync {command}", None, (command,))
+        else:
+            key = (instr_name, command, argument)
+            step = resolved.get(key)
+            if step is None:
+                step = _resolve(instruments.get(instr_name), *key)
+                if step is None:
+                    raise ValueError("Instrument not connected\n"
+                                     f"Check index [{i}]")
+                resolved[key] = step
+        yield Step(i, instr_name, *step, float(offset), float(_time), lane)
+        offset += _time
+
+
+def _resolve(instr, instr_name: str, command: str, argument
+             ) -> tuple[str, str, Callable, tuple] | None:
+    """Bound method, parsed arguments and description of a command"""
+    if instr is None:
+        return None
+    # --- ARMxl command --- #
+    elif instr_name == "armxl":
+        if not isinstance(argument, str):
+            argument = str(argument)
+        return (str(instr), f"{command} - {argument}", instr.run_script,
+                (command, argument))
+    # --- SCPI or MODBUS command --- #
+    command = command.strip()
+    args = arg_parse(argument)
+    return (str(instr), f"{command} - {args}", getattr(instr, command),
+            tuple(args) if args is not None else ())
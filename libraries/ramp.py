@@ -0,0 +1,278 @@
+"""Shared engine for setpoint ramps (gradients)"""
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+from concurrent.futures import Executor
+from contextlib import nullcontext
+from typing import Any, Callable, ContextManager, Hashable, Iterable
+
+from .clock import Clock
+
+_logger = logging.getLogger(__name__)
+
+
+class Ramp:
+    """Sequence of setpoints written on an absolute timeline"""
+
+    def __init__(self, key: Hashable, target: Callable[[Any], Any],
+                 values: Iterable, period: float, start: float,
+                 lock: ContextManager | None = None) -> None:
+        self.key = key
+        self.target = target
+        self.lock = lock if lock is not None else nullcontext()
+        self.values = list(values)
+        self.period = period
+        self.start = start
+        self.index = 0  # next value to write
+        self.cancelled = False
+
+    def deadline(self) -> float:
+        """Absolute deadline of the next value"""
+        return self.start + self.index * self.period
+
+    @property
+    def done(self) -> bool:
+        return self.cancelled or self.index >= len(self.values)
+
+
+class RampEngine:
+    """Run any number of ramps on a single timer thread.
+
+    The value i of a ramp is written at 'start + i*period', whatever the
+    latency of the previous writes. If the thread falls behind, the values
+    already expired are skipped and only the latest one is written.
+    A new ramp with the same key replaces the running one.
+    The lock of the ramp (e.g. the instrument lock) is always taken before
+    the engine lock, so 'cancel' can be called while holding it.
+    Deadlines are on the timeline of 'clock' (virtual time for rehearsal).
+    """
+
+    def __init__(self, clock: Clock | None = None) -> None:
+        self.clock = clock if clock is not None else Clock()
+        self._cond = threading.Condition()
+        self._busy = threading.RLock()  # held while writing a value
+        self._queue: list[tuple[float, int, Ramp]] = []
+        self._ramps: dict[Hashable, Ramp] = {}
+        self._counter = itertools.count()
+        self._thread: threading.Thread | None = None
+
+    def start_ramp(self, key: Hashable, target: Callable[[Any], Any],
+                   values: Iterable, period: float,
+                   start: float | None = None,
+                   lock: ContextManager | None = None) -> Ramp:
+        """Schedule a new ramp, replacing the one with the same key\n
+        Args:
+            key (Hashable): ramp identifier, e.g. (instrument, register)
+            target (Callable[[Any], Any]): function that writes one value
+            values (Iterable): values to write, in order
+            period (float): seconds between two values
+            start (float | None, optional): 'clock.monotonic()' of the
+            first value. Defaults to now.
+            lock (ContextManager | None, optional): held while writing a
+            value. Defaults to None.\n
+        Returns:
+            Ramp: the scheduled ramp
+        """
+        if start is None:
+            start = self.clock.monotonic()
+        ramp = Ramp(key, target, values, period, start, lock)
+        with self._busy, self._cond:
+            self._cancel(key)
+            if ramp.done:
+                return ramp
+            self._ramps[key] = ramp
+            heapq.heappush(self._queue,
+                           (ramp.deadline(), next(self._counter), ramp))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run,
+                                                name="RampEngine",
+                                                daemon=True)
+                self.clock.enter(self._thread)
+                self._thread.start()
+            self.clock.notify(self._cond)
+        return ramp
+
+    def cancel(self, key: Hashable) -> bool:
+        """Stop the ramp with this key. Wait the end of a running write\n
+        Returns:
+            bool: 'True' if a ramp was running. 'False' otherwise
+        """
+        with self._busy, self._cond:
+            return self._cancel(key)
+
+    def is_running(self, key: Hashable) -> bool:
+        with self._cond:
+            return key in self._ramps
+
+    def _cancel(self, key: Hashable) -> bool:
+        ramp = self._ramps.pop(key, None)
+        if ramp is None:
+            return False
+        ramp.cancelled = True
+        self.clock.notify(self._cond)
+        return True
+
+    def _next_due(self) -> tuple[Ramp, Any]:
+        """Wait the first expired value and advance its ramp"""
+        with self._cond:
+            while True:
+                while self._queue and self._queue[0][2].cancelled:
+                    heapq.heappop(self._queue)
+                if not self._queue:
+                    self.clock.wait_condition(self._cond, None)
+                    continue
+                deadline, _, ramp = self._queue[0]
+                timeout = deadline - self.clock.monotonic()
+                if timeout <= 0:
+                    heapq.heappop(self._queue)
+                    break
+                self.clock.wait_condition(self._cond, timeout)
+            # skip values already expired
+            now = self.clock.monotonic()
+            due = int((now - ramp.start) // ramp.period)
+            index = min(max(ramp.index, due), len(ramp.values) - 1)
+            value = ramp.values[index]
+            ramp.index = index + 1
+            if ramp.done:
+                if self._ramps.get(ramp.key) is ramp:
+                    del self._ramps[ramp.key]
+            else:
+                heapq.heappush(self._queue,
+                               (ramp.deadline(), next(self._counter), ramp))
+            return ramp, value
+
+    def _run(self):
+        while True:
+            ramp, value = self._next_due()
+            with ramp.lock, self._busy:
+                if ramp.cancelled:
+                    continue
+                try:
+                    ramp.target(value)
+                except Exception:
+                    _logger.exception(f"Ramp {ramp.key} stopped")
+                    with self._cond:
+                        if self._ramps.get(ramp.key) is ramp:
+                            self._cancel(ramp.key)
+
+
+class AsyncRampEngine:
+    """Same interface of 'RampEngine', every ramp is a task on an asyncio
+    event loop and the values are written on an executor.
+
+    'start_ramp' and 'cancel' can be called from any thread, e.g. from an
+    instrument method running on an executor. A value is written only if
+    the ramp is not cancelled once its lock is taken.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop,
+                 executor: Executor | None = None,
+                 clock: Clock | None = None) -> None:
+        self.clock = clock if clock is not None else Clock()
+        self._loop = loop
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._ramps: dict[Hashable, Ramp] = {}
+        self._tasks: dict[Ramp, asyncio.Task] = {}
+
+    def start_ramp(self, key: Hashable, target: Callable[[Any], Any],
+                   values: Iterable, period: float,
+                   start: float | None = None,
+                   lock: ContextManager | None = None) -> Ramp:
+        """See 'RampEngine.start_ramp'"""
+        if start is None:
+            start = self.clock.monotonic()
+        ramp = Ramp(key, target, values, period, start, lock)
+        with self._lock:
+            self._cancel(key)
+            if ramp.done:
+                return ramp
+            self._ramps[key] = ramp
+        self._call_soon(self._spawn, ramp)
+        return ramp
+
+    def cancel(self, key: Hashable) -> bool:
+        """Stop the ramp with this key\n
+        Returns:
+            bool: 'True' if a ramp was running. 'False' otherwise
+        """
+        with self._lock:
+            return self._cancel(key)
+
+    def cancel_all(self):
+        with self._lock:
+            for key in list(self._ramps):
+                self._cancel(key)
+
+    def is_running(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._ramps
+
+    def _cancel(self, key: Hashable) -> bool:
+        ramp = self._ramps.pop(key, None)
+        if ramp is None:
+            return False
+        ramp.cancelled = True
+        self._call_soon(self._cancel_task, ramp)
+        return True
+
+    def _call_soon(self, func: Callable, *args):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            func(*args)
+        else:
+            self._loop.call_soon_threadsafe(func, *args)
+
+    def _spawn(self, ramp: Ramp):
+        if not ramp.cancelled:
+            self._tasks[ramp] = self._loop.create_task(self._run(ramp))
+            self.clock.enter(self._tasks[ramp])
+
+    def _cancel_task(self, ramp: Ramp):
+        task = self._tasks.pop(ramp, None)
+        if task is not None:
+            task.cancel()
+
+    async def _run(self, ramp: Ramp):
+        try:
+            while not ramp.done:
+                await self.clock.async_sleep(ramp.deadline()
+                                             - self.clock.monotonic())
+                # skip values already expired
+                now = self.clock.monotonic()
+                due = int((now - ramp.start) // ramp.period)
+                index = min(max(ramp.index, due), len(ramp.values) - 1)
+                ramp.index = index + 1
+                await self._loop.run_in_executor(
+                    self._executor, self._write, ramp, ramp.values[index])
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            _logger.exception(f"Ramp {ramp.key} stopped")
+        finally:
+            self._tasks.pop(ramp, None)
+            with self._lock:
+                if self._ramps.get(ramp.key) is ramp:
+                    del self._ramps[ramp.key]
+
+    @staticmethod
+    def _write(ramp: Ramp, value):
+        with ramp.lock:
+            if not ramp.cancelled:
+                ramp.target(value)
+
+
+ramp_engine: RampEngine | AsyncRampEngine = RampEngine()
+
+
+def use_engine(engine: RampEngine | AsyncRampEngine
+               ) -> RampEngine | AsyncRampEngine:
+    """Set the engine used by the instruments, return the previous one"""
+    global ramp_engine
+    previous, ramp_engine = ramp_engine, engine
+    return previous
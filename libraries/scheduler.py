@@ -0,0 +1,149 @@
+"""Deadline scheduler for sequential command execution"""
+import logging
+import threading
+from typing import NamedTuple
+
+from .clock import Clock
+
+_logger = logging.getLogger(__name__)
+
+
+class StepTiming(NamedTuple):
+    """Timing of one executed step, in seconds from sequence start"""
+    index: int
+    planned: float
+    fired: float
+    late: float
+
+
+class SequenceAborted(Exception):
+    """The sequence was stopped by 'DeadlineScheduler.abort'"""
+
+
+class DeadlineScheduler:
+    """Schedule every step on an absolute monotonic timeline.
+
+    Each step has a planned offset from the start of the sequence, so the
+    execution time of a command never shifts the following steps. Pause
+    shifts the whole remaining timeline by the paused time, skip moves it
+    back to 'now'.
+    More lanes (threads) can wait on the same timeline: pause is counted
+    once and skip brings the first pending step of any lane to 'now'.
+    'abort' stops every lane at its next wait ('SequenceAborted').
+    Every time and wait is read from 'clock' (virtual time for rehearsal).
+    """
+
+    PAUSE_POLL = 0.25  # s of real time, max delay to notice a pause
+
+    def __init__(self, skip_event: threading.Event,
+                 play_event: threading.Event,
+                 clock: Clock | None = None) -> None:
+        self.skip_event = skip_event
+        self.play_event = play_event
+        self.clock = clock if clock is not None else Clock()
+        self.abort_event = threading.Event()  # shared stop of the lanes
+        self.timings: list[StepTiming] = []
+        self._origin = self.clock.monotonic()
+        self._shift = 0.0  # pause and skip correction
+        self._lock = threading.Lock()
+        self._pending: dict[int, float] = {}  # thread -> offset waited
+        self._paused_at: float | None = None
+
+    def start(self):
+        """Set the origin of the timeline to now"""
+        self._origin = self.clock.monotonic()
+        self._shift = 0.0
+        self._pending.clear()
+        self._paused_at = None
+        self.timings.clear()
+        self.abort_event.clear()
+
+    def abort(self):
+        """Stop every lane at its next wait, waking the waiting ones"""
+        self.abort_event.set()
+        self.skip_event.set()
+
+    def deadline(self, offset: float) -> float:
+        """Absolute monotonic deadline of the planned offset"""
+        return self._origin + self._shift + offset
+
+    def elapsed(self) -> float:
+        """Seconds from start, pause and skip corrected"""
+        return self.clock.monotonic() - self._origin - self._shift
+
+    def fire(self, index: int, offset: float) -> StepTiming:
+        """Record the actual start time of a step\n
+        Args:
+            index (int): step index
+            offset (float): planned offset from sequence start\n
+        Returns:
+            StepTiming: timing record of the step
+        """
+        fired = self.elapsed()
+        timing = StepTiming(index, offset, fired, fired - offset)
+        self.timings.append(timing)
+        return timing
+
+    def wait_until(self, offset: float) -> bool:
+        """Block until the planned offset, handling pause and skip\n
+        Args:
+            offset (float): planned offset from sequence start\n
+        Raises:
+            SequenceAborted: if the sequence was aborted\n
+        Returns:
+            bool: 'True' if the wait was skipped. 'False' otherwise
+        """
+        thread = threading.get_ident()
+        skipped = False
+        with self._lock:
+            self._pending[thread] = offset
+        try:
+            while True:
+                self._check_abort()
+                if not self.play_event.is_set():
+                    with self._lock:
+                        if self._paused_at is None:
+                            self._paused_at = self.clock.monotonic()
+                    with self.clock.blocked():
+                        while not self.play_event.wait(self.PAUSE_POLL):
+                            self._check_abort()
+                    with self._lock:
+                        if self._paused_at is not None:  # first to resume
+                            paused = self.clock.monotonic() - self._paused_at
+                            self._shift += paused
+                            self._paused_at = None
+                            _logger.debug(f"Paused for {paused:.1f} s")
+                remaining = self.deadline(offset) - self.clock.monotonic()
+                if remaining <= 0:
+                    return skipped
+                poll = self.PAUSE_POLL * self.clock.speed
+                if self.clock.wait(self.skip_event, min(remaining, poll)):
+                    self._check_abort()
+                    with self._lock:
+                        if self.skip_event.is_set():
+                            self.skip_event.clear()
+                            # new timeline: first pending step planned now
+                            first = min(self._pending.values())
+                            self._shift -= (self.deadline(first)
+                                            - self.clock.monotonic())
+                            skipped = skipped or offset <= first
+        finally:
+            with self._lock:
+                del self._pending[thread]
+
+    def summary(self) -> str:
+        """Lateness statistics of the executed steps"""
+        return timing_summary(self.timings)
+
+    def _check_abort(self):
+        if self.abort_event.is_set():
+            raise SequenceAborted("Sequence aborted")
+
+
+def timing_summary(timings: list[StepTiming]) -> str:
+    """Lateness statistics of the executed steps"""
+    if not timings:
+        return "No step executed"
+    late = [t.late for t in timings]
+    return (f"{len(late)} steps, lateness max {max(late)*1000:.1f} ms, "
+            f"mean {sum(late)/len(late)*1000:.1f} ms")
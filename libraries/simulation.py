@@ -0,0 +1,696 @@
+"""Simulated instruments for dry runs without hardware.
+
+- SCPI instruments (ITECH, CHROMA, HP6032A, MSO58B): in-process VISA
+  resources answering from an instrument model, installed in the shared
+  'resource_pool' with 'install_visa'
+- ACS Discovery1200: in-process Modbus register map of the chamber, with
+  temperature and humidity following the setpoints
+- ARMxl: stub SSH client running the ARES scripts on a charger model
+
+Every model keeps the log of the received commands (clock time, command) to
+check a sequence after the run.
+"""
+import io
+import logging
+import re
+import shlex
+import threading
+import time
+from typing import Callable, NamedTuple
+
+import numpy as np
+import paramiko
+import pyvisa
+from pymodbus.pdu import ExceptionResponse, ModbusExceptions
+from pymodbus.register_read_message import ReadHoldingRegistersResponse
+from pymodbus.register_write_message import WriteMultipleRegistersResponse
+
+from .Chamber import ACS_Discovery1200
+from .Connection import Charger, ChargerGroup
+from .other_SCPI import resource_pool
+
+_logger = logging.getLogger(__name__)
+Clock = Callable[[], float]
+
+
+###########################
+# ----- SCPI models ----- #
+###########################
+def scpi_path(header: str) -> tuple[str, ...]:
+    """Header nodes in short form, e.g. 'VOLTage:LIMit' -> ('VOLT', 'LIM')"""
+    nodes = []
+    for node in header.strip(":").upper().split(":"):
+        node = node.rstrip("0123456789")  # numeric suffix, e.g. SOUR2
+        nodes.append(node[:3] if len(node) > 3 and node[3] in "AEIOU"
+                     else node[:4])
+    return tuple(nodes)
+
+
+def scpi_bool(value: str) -> bool:
+    return value.strip().upper() in ("1", "ON", "TRUE")
+
+
+class SCPIModel:
+    """State of a SCPI instrument, changed by the received messages.
+
+    'SETTINGS' maps a header to a state value (set with an argument, read
+    with '?'); 'COMMANDS' maps a header to a method 'f(args, query)'.
+    Headers are matched in short form, as the instrument does.
+    """
+    IDN = "SIM,Instrument,0,1.0"
+    SETTINGS: dict[str, str] = {}
+    COMMANDS: dict[str, str] = {}
+
+    def __init__(self, clock: Clock = time.monotonic) -> None:
+        self.clock = clock
+        self.state: dict[str, float | bool | str] = {}
+        self.log: list[tuple[float, str]] = []
+        self.errors: list[str] = []
+        self._settings = {scpi_path(h): k for h, k in self.SETTINGS.items()}
+        self._commands = {scpi_path(h): m for h, m in self.COMMANDS.items()}
+        self.reset()
+
+    def reset(self):
+        """*RST: default state"""
+
+    def handle(self, message: str) -> str | None:
+        """Execute a message (';' separated commands), reply of the queries
+        joined by ';' or None"""
+        replies = []
+        previous: tuple[str, ...] = ()
+        for command in message.split(";"):
+            command = command.strip()
+            if not command:
+                continue
+            header, _, args = command.partition(" ")
+            query = header.endswith("?")
+            path = scpi_path(header.rstrip("?"))
+            if not header.startswith((":", "*")) and previous and \
+                    not self._known(path):
+                path = previous[:-1] + path  # relative to the previous one
+            previous = path
+            self.log.append((self.clock(), command))
+            reply = self._execute(path, args.strip(), query, command)
+            if query and reply is not None:
+                replies.append(str(reply))
+        return ";".join(replies) if replies else None
+
+    def _known(self, path: tuple[str, ...]) -> bool:
+        return path in self._settings or path in self._commands or \
+            path[0].startswith("*")
+
+    def _execute(self, path, args: str, query: bool, command: str):
+        if path[0].startswith("*"):
+            return self._common(path[0], args, query)
+        if path in self._settings:
+            key = self._settings[path]
+            if query:
+                return self.state[key]
+            current = self.state[key]
+            self.state[key] = (scpi_bool(args) if isinstance(current, bool)
+                               else float(args)
+                               if isinstance(current, float) else args)
+            return None
+        if path in self._commands:
+            return getattr(self, self._commands[path])(args, query)
+        self.errors.append(command)
+        _logger.debug(f"{type(self).__name__}: unknown command {command!r}")
+        return None
+
+    def _common(self, name: str, args: str, query: bool):
+        if name == "*IDN":
+            return self.IDN
+        if name == "*RST":
+            self.reset()
+        elif name == "*CLS":
+            self.errors.clear()
+        elif name in ("*OPC", "*CAL", "*TST"):
+            return "1" if name == "*OPC" else "0"
+        return None
+
+
+class ITECHModel(SCPIModel):
+    """ITECH bidirectional source/load on a resistive load"""
+    IDN = "ITECH Ltd.,IT6000C,SIM,1.0"
+    LOAD_OHM = 10.0
+    SETTINGS = {
+        "OUTPut": "output",
+        "FUNCtion": "function",
+        "FUNCtion:MODE": "mode",
+        "VOLTage": "voltage",
+        "CURRent": "current",
+        "VOLTage:LIMit:NEGative": "v_neg",
+        "VOLTage:LIMit:POSitive": "v_pos",
+        "CURRent:LIMit:NEGative": "i_neg",
+        "CURRent:LIMit:POSitive": "i_pos",
+        }
+    COMMANDS = {"FETch:SCALar": "fetch", "MEASure:SCALar": "fetch"}
+
+    def reset(self):
+        self.state.update(output=False, function="VOLTAGE", mode="FIXED",
+                          voltage=0.0, current=0.0, v_neg=0.0, v_pos=1000.0,
+                          i_neg=-100.0, i_pos=100.0)
+
+    def measure(self) -> tuple[float, float]:
+        """Output voltage and current"""
+        s = self.state
+        if not s["output"]:
+            return 0.0, 0.0
+        if str(s["function"]).upper().startswith("CURR"):  # CC mode
+            current = s["current"]
+            voltage = min(max(current * self.LOAD_OHM, s["v_neg"]),
+                          s["v_pos"])
+            return voltage, voltage / self.LOAD_OHM
+        voltage = s["voltage"]
+        current = min(max(voltage / self.LOAD_OHM, s["i_neg"]), s["i_pos"])
+        return current * self.LOAD_OHM, current
+
+    def fetch(self, args: str, query: bool):
+        voltage, current = self.measure()
+        return f"{voltage},{current},{voltage * current},0,0"
+
+
+class CHROMAModel(SCPIModel):
+    """CHROMA grid simulator, three phases on resistive loads"""
+    IDN = "Chroma ATE,61845,SIM,1.0"
+    LOAD_OHM = 50.0
+    PHASES = (1, 2, 3)
+    SETTINGS = {
+        "OUTPut": "output",
+        "FREQuency": "frequency",
+        "INSTrument:COUPle": "couple",
+        }
+    COMMANDS = {
+        "INSTrument:NSELect": "select",
+        "VOLTage:AC": "set_voltage",
+        "VOLTage:DC": "set_voltage",
+        "FETCh:FREQuency": "fetch_frequency",
+        "FETCh:VOLTage": "fetch_voltage",
+        "FETCh:VOLTage:AC": "fetch_voltage",
+        "FETCh:VOLTage:ACDC": "fetch_voltage",
+        "FETCh:CURRent": "fetch_current",
+        "FETCh:CURRent:AC": "fetch_current",
+        "FETCh:CURRent:ACDC": "fetch_current",
+        "FETCh:POWer": "fetch_power",
+        "FETCh:POWer:AC": "fetch_power",
+        "FETCh:POWer:AC:APParent": "fetch_power",
+        "FETCh:POWer:AC:PFACtor": "fetch_pf",
+        }
+
+    def reset(self):
+        self.state.update(output=False, frequency=50.0, couple="ALL",
+                          phase=1, **{f"voltage{i}": 0.0
+                                      for i in self.PHASES})
+
+    def select(self, args: str, query: bool):
+        if query:
+            return self.state["phase"]
+        self.state["phase"] = int(args)
+
+    def set_voltage(self, args: str, query: bool):
+        phases = (self.PHASES if self.state["couple"] == "ALL"
+                  else (self.state["phase"],))
+        if query:
+            return self.state[f"voltage{phases[0]}"]
+        for i in phases:
+            self.state[f"voltage{i}"] = float(args)
+
+    def measure(self) -> tuple[float, float]:
+        """Voltage and current of the selected phase"""
+        voltage = (self.state[f"voltage{self.state['phase']}"]
+                   if self.state["output"] else 0.0)
+        return voltage, voltage / self.LOAD_OHM
+
+    def fetch_frequency(self, args: str, query: bool):
+        return self.state["frequency"]
+
+    def fetch_voltage(self, args: str, query: bool):
+        return self.measure()[0]
+
+    def fetch_current(self, args: str, query: bool):
+        return self.measure()[1]
+
+    def fetch_power(self, args: str, query: bool):
+        voltage, current = self.measure()
+        return voltage * current
+
+    def fetch_pf(self, args: str, query: bool):
+        return 1.0
+
+
+class HP6032AModel(SCPIModel):
+    """HP6032A power supply on a resistive load"""
+    IDN = "HEWLETT-PACKARD,6032A,SIM,1.0"
+    LOAD_OHM = 10.0
+    SETTINGS = {"OUTPut": "output", "VOLTage": "voltage",
+                "CURRent": "current"}
+    COMMANDS = {"MEASure:VOLTage": "measure_voltage",
+                "MEASure:CURRent": "measure_current"}
+
+    def reset(self):
+        self.state.update(output=False, voltage=0.0, current=0.0)
+
+    def measure_voltage(self, args: str, query: bool):
+        return self.state["voltage"] if self.state["output"] else 0.0
+
+    def measure_current(self, args: str, query: bool):
+        voltage = self.measure_voltage(args, query)
+        return min(voltage / self.LOAD_OHM, self.state["current"])
+
+
+class MSO58BModel(SCPIModel):
+    """MSO58B oscilloscope: only the saved screens are modeled"""
+    IDN = "TEKTRONIX,MSO58B,SIM,1.0"
+    COMMANDS = {"SAVe:IMAGe": "save_image",
+                "DISplay:WAVEview:ZOOM:ZOOM:STATe": "zoom"}
+
+    def reset(self):
+        self.state.update(zoom=False)
+        self.images: list[str] = []
+
+    def save_image(self, args: str, query: bool):
+        self.images.append(args.strip('"'))
+
+    def zoom(self, args: str, query: bool):
+        if query:
+            return int(self.state["zoom"])
+        self.state["zoom"] = scpi_bool(args)
+
+
+MODELS: dict[str, type[SCPIModel]] = {
+    "ITECH": ITECHModel,
+    "CHROMA": CHROMAModel,
+    "HP6032A": HP6032AModel,
+    "MSO58B": MSO58BModel,
+    }
+
+
+###############################
+# ----- in-process VISA ----- #
+###############################
+class _ResourceInfo(NamedTuple):
+    alias: str
+
+
+class SimResource:
+    """Message based VISA resource answering from a model"""
+
+    def __init__(self, address: str, model: SCPIModel) -> None:
+        self.resource_name = address
+        self.resource_info = _ResourceInfo(address)
+        self.model = model
+        self.timeout: float = 2000  # ms, as pyvisa
+        self.read_termination = "\n"
+        self.write_termination = "\n"
+        self._replies: list[str] = []
+        self._open = True
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"<SimResource({self.resource_name!r})>"
+
+    @property
+    def session(self) -> int:
+        if not self._open:
+            raise pyvisa.errors.InvalidSession()
+        return id(self)
+
+    def write(self, message: str) -> int:
+        self._check()
+        with self._lock:
+            reply = self.model.handle(message)
+            if reply is not None:
+                self._replies.append(reply)
+        return len(message) + len(self.write_termination)
+
+    def read(self, *args) -> str:
+        self._check()
+        with self._lock:
+            if not self._replies:
+                raise pyvisa.errors.VisaIOError(
+                    pyvisa.constants.StatusCode.error_timeout)
+            return self._replies.pop(0)
+
+    def read_raw(self, size: int | None = None) -> bytes:
+        return self.read().encode()
+
+    def query(self, message: str, delay: float | None = None) -> str:
+        self.write(message)
+        return self.read()
+
+    def query_ascii_values(self, message: str, converter="f",
+                           separator=",", **kwargs) -> list[float]:
+        return [float(v) for v in re.split(r"[;,]", self.query(message))]
+
+    def close(self):
+        self._open = False
+
+    def _check(self):
+        if not self._open:
+            raise pyvisa.errors.InvalidSession()
+
+
+class SimResourceManager:
+    """ResourceManager of the simulated resources, by address"""
+
+    def __init__(self, models: dict[str, SCPIModel]) -> None:
+        self.models = models
+
+    def list_resources(self, query: str = "?*::INSTR") -> tuple[str, ...]:
+        return tuple(self.models)
+
+    def open_resource(self, address: str, **kwargs) -> SimResource:
+        if address not in self.models:
+            raise pyvisa.errors.VisaIOError(
+                pyvisa.constants.StatusCode.error_resource_not_found)
+        resource = SimResource(address, self.models[address])
+        for name, value in kwargs.items():
+            setattr(resource, name, value)
+        return resource
+
+    def close(self):
+        pass
+
+
+def install_visa(models: dict[str, SCPIModel]):
+    """Open the simulated models (by address) instead of real instruments,
+    for every instrument of 'other_SCPI'"""
+    resource_pool.close_all()
+    resource_pool.factory = lambda visa_library: SimResourceManager(models)
+
+
+def uninstall_visa():
+    resource_pool.close_all()
+    resource_pool.factory = pyvisa.ResourceManager
+
+
+#################################
+# ----- in-process Modbus ----- #
+#################################
+def _float_registers(value: float) -> tuple[int, int]:
+    raw = int(np.float32(value).view(np.uint32))
+    return raw >> 16, raw & 0xFFFF
+
+
+def _register_float(high: int, low: int) -> float:
+    return float(np.uint32(int(high) << 16 | int(low)).view(np.float32))
+
+
+class ChamberModel:
+    """Register map of the ACS Discovery1200.
+
+    Writes to the 'writing_area' are copied to the 'reading_area' as the
+    chamber does; with run and temperature (humidity) enabled the measure
+    follows the setpoint at the maximum gradient, otherwise it goes back to
+    the ambient value.
+    """
+    SIZE = 600  # registers
+    AMBIENT = (23.0, 50.0)  # °C, %
+    RATE = (4.5, 2.3, 5.0)  # °C/min up, °C/min down, %/min
+    _bits = {"run": 0, "enable temp": 8, "enable hum": 9}
+
+    def __init__(self, clock: Clock = time.monotonic) -> None:
+        self.clock = clock
+        self.registers = np.zeros(self.SIZE, dtype=np.uint16)
+        self.log: list[tuple[float, str]] = []
+        self.temp, self.hum = self.AMBIENT
+        self._last = clock()
+        self._lock = threading.Lock()
+        area = ACS_Discovery1200.writing_area
+        self._run_address = area["run_setting"]["run"][0]
+        self._setpoint = dict(area["setpoint"])
+        self._mirror = {  # writing address -> reading addresses
+            self._run_address: (
+                ACS_Discovery1200.reading_area["user_setting"]["run"][0],
+                ACS_Discovery1200.reading_area["device_setting"]["run"][0]),
+            **{address: (ACS_Discovery1200.reading_area["setpoint"][name],)
+               for name, address in self._setpoint.items()}}
+        self._update(0)
+
+    def read(self, address: int, count: int) -> list[int] | None:
+        with self._lock:
+            if address < 0 or address + count > self.SIZE:
+                return None
+            self._advance()
+            return self.registers[address:address + count].tolist()
+
+    def write(self, address: int, values: list[int]) -> bool:
+        with self._lock:
+            if address < 0 or address + len(values) > self.SIZE:
+                return False
+            self._advance()
+            self.registers[address:address + len(values)] = values
+            self.log.append((self.clock(), f"{address}: {list(values)}"))
+            for i in range(len(values)):
+                for target in self._mirror.get(address + i, ()):
+                    self.registers[target] = self.registers[address + i]
+            # alarm reset: impulsive bit, cleared by the chamber
+            self.registers[self._run_address] &= ~np.uint16(1 << 1)
+            self._update(0)
+            return True
+
+    def setpoint(self, name: str) -> float:
+        address = self._setpoint[name]
+        return _register_float(*self.registers[address:address + 2])
+
+    def setting(self, name: str) -> bool:
+        return bool(self.registers[self._run_address] >> self._bits[name] & 1)
+
+    def _advance(self):
+        now = self.clock()
+        minutes, self._last = (now - self._last) / 60, now
+        self._update(minutes)
+
+    def _update(self, minutes: float):
+        run = self.setting("run")
+        target = (self.setpoint("Temp") if run and self.setting("enable temp")
+                  else self.AMBIENT[0])
+        rate = self.RATE[0] if target > self.temp else self.RATE[1]
+        self.temp += np.clip(target - self.temp, -rate * minutes,
+                             rate * minutes)
+        target = (self.setpoint("Hum") if run and self.setting("enable hum")
+                  else self.AMBIENT[1])
+        self.hum += np.clip(target - self.hum, -self.RATE[2] * minutes,
+                            self.RATE[2] * minutes)
+        measure = ACS_Discovery1200.reading_area["measure"]
+        for name, value in (("Temp", self.temp), ("dry bulb", self.temp),
+                            ("Rel Hum", self.hum)):
+            address = measure[name]
+            self.registers[address:address + 2] = _float_registers(value)
+        current = ACS_Discovery1200.reading_area["setpoint"]
+        for name, value in (("Temp_current", self.temp),
+                            ("Hum_current", self.hum)):
+            address = current[name]
+            self.registers[address:address + 2] = _float_registers(value)
+
+
+class SimulatedACS_Discovery1200(ACS_Discovery1200):
+    """ACS_Discovery1200 on the in-process register map, no serial port"""
+
+    def __init__(self, port: str = "SIM", slave_address: int | None = None,
+                 model: ChamberModel | None = None, **kwargs):
+        self.model = model or ChamberModel()
+        super().__init__(port, slave_address, **kwargs)
+
+    def __str__(self):
+        return "ACS Discovery D1200 - simulated"
+
+    def connect(self) -> bool:
+        return True
+
+    def close(self):
+        pass
+
+    def is_socket_open(self) -> bool:
+        return True
+
+    def read_holding_registers(self, address, count=1, **kwargs):
+        registers = self.model.read(address, count)
+        if registers is None:
+            return ExceptionResponse(0x03, ModbusExceptions.IllegalAddress)
+        return ReadHoldingRegistersResponse(registers)
+
+    def write_registers(self, address, values, **kwargs):
+        if not hasattr(values, "__iter__"):
+            values = [values]
+        values = [int(v) for v in values]
+        if not self.model.write(address, values):
+            return ExceptionResponse(0x10, ModbusExceptions.IllegalAddress)
+        return WriteMultipleRegistersResponse(address, len(values))
+
+
+########################
+# ----- stub SSH ----- #
+########################
+class AresModel:
+    """State of an ARMxl changed by the ARES scripts"""
+
+    def __init__(self, hostname: str = "armxl-sim",
+                 clock: Clock = time.monotonic) -> None:
+        self.hostname = hostname
+        self.clock = clock
+        self.voltage = 0.0  # V
+        self.power = 0.0  # kW
+        self.reactive = 0.0  # kVAR
+        self.fan = 0
+        self.session = False
+        self.log: list[tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def run(self, command: str) -> tuple[int, str, str]:
+        """Execute a shell command: exit status, stdout, stderr"""
+        with self._lock:
+            self.log.append((self.clock(), command))
+            try:
+                argv = shlex.split(command)
+            except ValueError as e:
+                return 2, "", str(e)
+            if argv[:1] == ["nohup"]:  # detached, output discarded
+                argv = [arg for arg in argv[1:]
+                        if arg not in ("&", "2>&1") and arg[:1] != ">"]
+            if not argv:
+                return 0, "", ""
+            name, args = argv[0].removeprefix("./"), argv[1:]
+            try:
+                if name == "hostname":
+                    return 0, self.hostname, ""
+                if name == "set_voltage_and_power.sh":
+                    self.voltage = int(args[0]) / 10
+                    self.power = int(args[1]) / 10
+                elif name == "set_power.sh":
+                    self.power = int(args[0]) / 10
+                elif name == "set_reactive.sh":
+                    value = int(args[0])
+                    self.reactive = ((value - 32768) / -10 if value > 32000
+                                     else value / 10)
+                elif name == "force_fan.sh":
+                    self.fan = int(args[0])
+                elif name == "start_charge_session.sh":
+                    self.session = True
+                elif name == "stop_charge_session.sh":
+                    self.session = False
+                elif name not in ("cd", "chmod", "sha1sum", "ls", "true"):
+                    return 127, "", f"{name}: command not found"
+            except (IndexError, ValueError) as e:
+                return 1, "", f"{name}: {e}"
+            return 0, "", ""
+
+
+ares_models: dict[str, AresModel] = {}  # by host, created on connection
+
+
+class _StubChannel:
+    """'exec' channel: the command runs on the model at once"""
+
+    def __init__(self, model: AresModel) -> None:
+        self.model = model
+        self.closed = False
+        self.eof_received = False
+        self._result = (0, "", "")
+        self._stdout = io.BytesIO()
+        self._stderr = io.BytesIO()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def exec_command(self, command: str):
+        self._result = self.model.run(command)
+        self._stdout = io.BytesIO(self._result[1].encode())
+        self._stderr = io.BytesIO(self._result[2].encode())
+        self.eof_received = True
+
+    def makefile(self, mode: str = "rb"):
+        return io.BytesIO(self._result[1].encode())
+
+    def makefile_stderr(self, mode: str = "rb"):
+        return io.BytesIO(self._result[2].encode())
+
+    def recv_ready(self) -> bool:
+        return self._stdout.tell() < len(self._stdout.getbuffer())
+
+    def recv(self, nbytes: int) -> bytes:
+        return self._stdout.read(nbytes)
+
+    def recv_stderr_ready(self) -> bool:
+        return self._stderr.tell() < len(self._stderr.getbuffer())
+
+    def recv_stderr(self, nbytes: int) -> bytes:
+        return self._stderr.read(nbytes)
+
+    def exit_status_ready(self) -> bool:
+        return self.eof_received
+
+    def recv_exit_status(self) -> int:
+        return self._result[0]
+
+    def close(self):
+        self.closed = True
+
+
+class _StubTransport:
+
+    def __init__(self, model: AresModel) -> None:
+        self.model = model
+        self.active = True
+
+    def set_keepalive(self, interval: int):
+        pass
+
+    def is_active(self) -> bool:
+        return self.active
+
+    def open_session(self) -> _StubChannel:
+        if not self.active:
+            raise paramiko.SSHException("SSH session not active")
+        return _StubChannel(self.model)
+
+
+class StubSSHClient:
+    """Same interface of 'paramiko.SSHClient' used by 'Charger'; commands
+    run on the 'AresModel' of the host. SFTP is not simulated"""
+
+    def __init__(self) -> None:
+        self.model: AresModel | None = None
+        self._transport: _StubTransport | None = None
+
+    def set_missing_host_key_policy(self, policy):
+        pass
+
+    def load_system_host_keys(self, filename: str | None = None):
+        pass
+
+    def connect(self, hostname: str, username: str | None = None,
+                password: str | None = None, **kwargs):
+        self.model = ares_models.setdefault(
+            hostname, AresModel(f"armxl-{hostname}"))
+        self._transport = _StubTransport(self.model)
+
+    def exec_command(self, command: str):
+        channel = self._transport.open_session()
+        channel.exec_command(command)
+        return io.StringIO(), channel.makefile(), channel.makefile_stderr()
+
+    def get_transport(self) -> _StubTransport:
+        return self._transport
+
+    def invoke_shell(self) -> _StubChannel:
+        return self._transport.open_session()
+
+    def open_sftp(self):
+        raise paramiko.SSHException("SFTP not simulated")
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.active = False
+
+
+class SimulatedCharger(Charger):
+    """Charger on the stub SSH client"""
+    ssh_client = StubSSHClient
+
+
+class SimulatedChargerGroup(ChargerGroup):
+    charger = SimulatedCharger
@@ -0,0 +1,208 @@
+"""Background sampling of the instrument measures"""
+import heapq
+import logging
+import math
+import threading
+from contextlib import nullcontext
+from typing import Any, Callable, ContextManager, Iterable
+
+import numpy as np
+
+from .clock import Clock, ClockEvent
+
+_logger = logging.getLogger(__name__)
+
+
+class RingBuffer:
+    """Preallocated buffer of the last 'capacity' timestamped samples.
+
+    Writers and readers share a lock held only to copy the rows, so a
+    reader never waits an instrument read.
+    """
+
+    def __init__(self, capacity: int, width: int) -> None:
+        self.capacity = capacity
+        self.times = np.full(capacity, np.nan)
+        self.values = np.full((capacity, width), np.nan)
+        self._next = 0  # total samples written
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return min(self._next, self.capacity)
+
+    def append(self, timestamp: float, row: Iterable[float]):
+        with self._lock:
+            i = self._next % self.capacity
+            self.times[i] = timestamp
+            self.values[i] = row
+            self._next += 1
+
+    def latest(self) -> tuple[float, np.ndarray] | None:
+        """Last sample (timestamp, values), None if empty"""
+        with self._lock:
+            if not self._next:
+                return None
+            i = (self._next - 1) % self.capacity
+            return float(self.times[i]), self.values[i].copy()
+
+    def history(self, seconds: float | None = None
+                ) -> tuple[np.ndarray, np.ndarray]:
+        """Samples in time order, only the last 'seconds' if given\n
+        Returns:
+            tuple[np.ndarray, np.ndarray]: timestamps (n,), values (n, width)
+        """
+        with self._lock:
+            n = len(self)
+            start = self._next - n
+            index = np.arange(start, self._next) % self.capacity
+            times = self.times[index]
+            values = self.values[index]
+        if seconds is not None and n:
+            first = np.searchsorted(times, times[-1] - seconds, side="left")
+            times, values = times[first:], values[first:]
+        return times, values
+
+
+class Channel:
+    """One instrument polled by the sampler"""
+
+    def __init__(self, name: str, read: Callable[[], Iterable[float]],
+                 fields: list[str], period: float, capacity: int,
+                 lock: ContextManager | None = None) -> None:
+        self.name = name
+        self.read = read
+        self.fields = list(fields)
+        self.period = period
+        self.lock = lock if lock is not None else nullcontext()
+        self.buffer = RingBuffer(capacity, len(self.fields))
+        self.errors = 0  # consecutive failed reads
+
+    def sample(self, timestamp: float) -> np.ndarray:
+        """Read the instrument, NaN for every field if the read fails"""
+        try:
+            with self.lock:
+                row = np.asarray(list(self.read()), dtype=float)
+            if row.shape != (len(self.fields),):
+                raise ValueError(f"expected {len(self.fields)} values, "
+                                 f"got {row.shape}")
+        except Exception as e:
+            self.errors += 1
+            if self.errors == 1 or math.log2(self.errors).is_integer():
+                _logger.warning(f"{self.name}: read failed "
+                                f"({self.errors} times): {e!r}")
+            row = np.full(len(self.fields), np.nan)
+        else:
+            self.errors = 0
+        self.buffer.append(timestamp, row)
+        return row
+
+
+class Sampler:
+    """Poll every channel at its own period on a single worker thread.
+
+    Samples are taken on an absolute timeline: if a read is slow the next
+    deadlines are not shifted, the expired ones are skipped. Timestamps are
+    wall clock ('clock.time') taken before the read.
+    """
+
+    def __init__(self, capacity: int = 86400, clock: Clock | None = None
+                 ) -> None:
+        self.capacity = capacity  # default samples kept for every channel
+        self.clock = clock if clock is not None else Clock()
+        self.channels: dict[str, Channel] = {}
+        self._listeners: list[Callable[[str, float, np.ndarray], Any]] = []
+        self._stop = ClockEvent()
+        self._thread: threading.Thread | None = None
+
+    def add(self, name: str, read: Callable[[], Iterable[float]],
+            fields: list[str], period: float, capacity: int | None = None,
+            lock: ContextManager | None = None) -> Channel:
+        """Add a channel, before 'start'\n
+        Args:
+            name (str): channel name
+            read (Callable[[], Iterable[float]]): return one value by field
+            fields (list[str]): name of the values
+            period (float): seconds between two samples
+            capacity (int | None, optional): samples kept. Defaults to the
+            sampler capacity.
+            lock (ContextManager | None, optional): held during the read.
+            Defaults to None.\n
+        Returns:
+            Channel: the new channel
+        """
+        if self._thread is not None:
+            raise RuntimeError("Sampler already started")
+        channel = Channel(name, read, fields, period,
+                          capacity or self.capacity, lock)
+        self.channels[name] = channel
+        return channel
+
+    def add_instrument(self, name: str, instrument: Any, period: float,
+                       capacity: int | None = None) -> Channel:
+        """Add an instrument with 'get_data' and 'DATA_OUTPUT'"""
+        return self.add(name, instrument.get_data, instrument.DATA_OUTPUT,
+                        period, capacity, getattr(instrument, "lock", None))
+
+    def add_listener(self, listener: Callable[[str, float, np.ndarray], Any]):
+        """Call 'listener(name, timestamp, values)' after every sample"""
+        self._listeners.append(listener)
+
+    def publish(self, name: str, timestamp: float, row: np.ndarray):
+        """Send a sample to the listeners"""
+        for listener in self._listeners:
+            try:
+                listener(name, timestamp, row)
+            except Exception:
+                _logger.exception(f"Telemetry listener {listener!r}")
+
+    def start(self):
+        if self._thread is not None or not self.channels:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="Sampler",
+                                        daemon=True)
+        self.clock.enter(self._thread)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None):
+        """Stop the worker, waiting the end of a running read"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def latest(self, name: str) -> dict[str, float]:
+        """Last values of the channel by field, empty if no sample yet"""
+        channel = self.channels[name]
+        last = channel.buffer.latest()
+        if last is None:
+            return {}
+        timestamp, values = last
+        return {"timestamp": timestamp,
+                **dict(zip(channel.fields, values.tolist()))}
+
+    def history(self, name: str, seconds: float | None = None
+                ) -> tuple[np.ndarray, np.ndarray]:
+        """Timestamps and values (one column by field) of the channel"""
+        return self.channels[name].buffer.history(seconds)
+
+    def _run(self):
+        try:
+            start = self.clock.monotonic()
+            queue = [(start, i, channel)
+                     for i, channel in enumerate(self.channels.values())]
+            heapq.heapify(queue)
+            while queue:
+                deadline, i, channel = queue[0]
+                remaining = deadline - self.clock.monotonic()
+                if self.clock.wait(self._stop, remaining):
+                    return
+                timestamp = self.clock.time()
+                self.publish(channel.name, timestamp,
+                             channel.sample(timestamp))
+                # next deadline on the timeline, skipping the expired ones
+                missed = (self.clock.monotonic() - deadline) // channel.period
+                deadline += (max(missed, 0) + 1) * channel.period
+                heapq.heapreplace(queue, (deadline, i, channel))
+        finally:
+            self.clock.leave()
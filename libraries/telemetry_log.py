@@ -0,0 +1,151 @@
+"""Append-only columnar log of the telemetry, written in NumPy chunks.
+
+Layout of a log folder:
+    <folder>/<table>/<n>.npz  one file for every flushed chunk, one array
+                              for every column
+Tables are one for every sampler channel (timestamp + DATA_OUTPUT columns)
+and 'steps' with the executed steps, to join on the timestamp.
+"""
+import os
+import threading
+import time
+from os import path
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+STEP_TABLE = "steps"
+# text columns are objects in memory, written as wide as the longest value
+STEP_COLUMNS = [("timestamp", "f8"), ("index", "i8"), ("offset", "f8"),
+                ("late", "f8"), ("instrument", "O"), ("label", "O")]
+
+
+class Table:
+    """Preallocated chunk of rows, flushed to a new file when full"""
+
+    def __init__(self, folder: str, dtype: np.dtype, chunk: int) -> None:
+        self.folder = folder
+        self.rows = np.zeros(chunk, dtype=dtype)
+        self.count = 0  # rows in the current chunk
+        self.chunks = 0  # chunks already on disk
+        self.last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def append(self, row: tuple):
+        with self._lock:
+            self.rows[self.count] = row
+            self.count += 1
+            if self.count == len(self.rows):
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.count:
+            return
+        data = self.rows[:self.count]
+        filename = path.join(self.folder, f"{self.chunks:06d}.npz")
+        tmp = f"{filename}.tmp.npz"
+        np.savez(tmp, **{name: _column(data[name])
+                         for name in data.dtype.names})
+        os.replace(tmp, filename)  # a chunk is on disk whole or not at all
+        self.chunks += 1
+        self.count = 0
+        self.last_flush = time.monotonic()
+
+
+def _column(values: np.ndarray) -> np.ndarray:
+    """Column as written: text (objects) as fixed width unicode, no pickle
+    needed to read it"""
+    if values.dtype.kind == "O":
+        return values.astype(str)
+    return values
+
+
+class TelemetryLog:
+    """Write samples and step boundaries in bounded memory.
+
+    Every table keeps in memory only its current chunk; it is written when
+    full or 'flush_interval' seconds after the previous write, so a crash
+    loses at most one chunk (or one interval) of data.
+    """
+
+    def __init__(self, folder: str, chunk: int = 3600,
+                 flush_interval: float = 300) -> None:
+        self.folder = folder
+        self.chunk = chunk
+        self.flush_interval = flush_interval
+        self.tables: dict[str, Table] = {}
+        self._lock = threading.Lock()
+        self.tables[STEP_TABLE] = Table(path.join(folder, STEP_TABLE),
+                                        np.dtype(STEP_COLUMNS), chunk)
+
+    def add_table(self, name: str, fields: Iterable[str]) -> Table:
+        """Add a sample table: timestamp + one float column by field"""
+        if name == STEP_TABLE:
+            raise ValueError(f"'{STEP_TABLE}' is a reserved table name")
+        dtype = np.dtype([("timestamp", "f8")] +
+                         [(field, "f8") for field in fields])
+        with self._lock:
+            table = Table(path.join(self.folder, name), dtype, self.chunk)
+            self.tables[name] = table
+        return table
+
+    def add_sample(self, name: str, timestamp: float,
+                   values: Iterable[float]):
+        """Append a sample, usable as a 'Sampler' listener"""
+        table = self.tables[name]
+        table.append((timestamp, *values))
+        self._flush_expired()
+
+    def add_step(self, timestamp: float, index: int, offset: float,
+                 late: float, instrument: str, label: str):
+        """Append the start of an executed step"""
+        self.tables[STEP_TABLE].append((timestamp, index, offset, late,
+                                        instrument, label))
+        self._flush_expired()
+
+    def flush(self):
+        """Write all the pending rows, e.g. at the end of the test"""
+        for table in list(self.tables.values()):
+            table.flush()
+
+    def _flush_expired(self):
+        now = time.monotonic()
+        for table in list(self.tables.values()):
+            if now - table.last_flush >= self.flush_interval:
+                table.flush()
+
+
+def read_table(folder: str, name: str) -> pd.DataFrame:
+    """Read all the chunks of a table, in order"""
+    folder = path.join(folder, name)
+    chunks = []
+    for filename in sorted(os.listdir(folder)):
+        if not filename.endswith(".npz") or ".tmp" in filename:
+            continue  # a chunk not completed before a crash
+        with np.load(path.join(folder, filename), allow_pickle=False) as f:
+            chunks.append(pd.DataFrame({k: f[k] for k in f.files}))
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks, ignore_index=True)
+
+
+def read_log(folder: str) -> dict[str, pd.DataFrame]:
+    """Read every table of a log folder by name"""
+    return {name: read_table(folder, name)
+            for name in sorted(os.listdir(folder))
+            if path.isdir(path.join(folder, name))}
+
+
+def join_steps(samples: pd.DataFrame, steps: pd.DataFrame) -> pd.DataFrame:
+    """Add to every sample the step running at its timestamp"""
+    steps = steps.rename(columns={"timestamp": "step_timestamp"})
+    return pd.merge_asof(samples.sort_values("timestamp"),
+                         steps.sort_values("step_timestamp"),
+                         left_on="timestamp", right_on="step_timestamp",
+                         direction="backward")
@@ -0,0 +1,227 @@
+"""Setpoint timeline of a sequence as NumPy step arrays, for the plots"""
+from datetime import datetime
+from typing import NamedTuple
+
+import matplotlib.dates as mdates
+import numpy as np
+import pandas as pd
+
+from .loader import LANE
+from .other_SCPI import ITECH
+from .plan import lane_offsets
+
+CHAMBER_STEP = 60  # s between two setpoint of a chamber gradient
+ON_VALUES = ("on", "1", "true")
+SIGNALS = ("clim_chamber.Temp", "clim_chamber.Hum",
+           "armxl.V", "armxl.S", "armxl.Q", "armxl.State",
+           "ac_source.V", "ac_source.F", "ac_source.State",
+           "dc_source.Vhigh", "dc_source.Vlow", "dc_source.Ihigh",
+           "dc_source.Ilow", "dc_source.State")
+
+
+class Trace(NamedTuple):
+    """Step trace ('where=post'): value[i] from time[i] to time[i+1]"""
+    time: np.ndarray  # matplotlib date number
+    value: np.ndarray  # NaN where not defined
+
+
+class Timeline(NamedTuple):
+    traces: dict[str, Trace]  # 'instrument.signal' -> trace
+    events: list[tuple[float, str]]  # (date number, text), e.g. DC mode
+    start: float  # date number of the sequence start
+    end: float  # date number of the sequence end
+
+
+def to_datenum(seconds: np.ndarray | float, base: float) -> np.ndarray:
+    """Seconds from sequence start to matplotlib date number"""
+    return base + np.asarray(seconds, dtype=float) / 86400
+
+
+def step_starts(df: pd.DataFrame) -> np.ndarray:
+    """Start of every step in seconds, with the lanes if present"""
+    if LANE in df:
+        return np.asarray(lane_offsets(df.Time, df.Instrument.str.lower(),
+                                       df.Command, df[LANE]), dtype=float)
+    times = df.Time.to_numpy(dtype=float)
+    return np.cumsum(times) - times
+
+
+def build_timeline(df: pd.DataFrame, base: float | None = None
+                   ) -> Timeline:
+    """Setpoint of every instrument signal along the sequence\n
+    Args:
+        df (pd.DataFrame): expanded sequence (see 'get_data')
+        base (float | None, optional): date number of the sequence start.
+        Defaults to today at 00:00:00.\n
+    Returns:
+        Timeline: traces and events as date numbers
+    """
+    if base is None:
+        base = mdates.date2num(datetime.combine(datetime.today(),
+                                                datetime.min.time()))
+    starts = step_starts(df)
+    end = float((starts + df.Time.to_numpy(dtype=float)).max(initial=0))
+    steps = pd.DataFrame({
+        "t": starts,
+        "instr": df.Instrument.str.lower().to_numpy(),
+        "cmd": df.Command.astype(str).str.strip().to_numpy(),
+        "arg": df.Argument.fillna("-").astype(str).to_numpy(),
+        })
+    builder = _Builder()
+    events = []
+    _chamber(steps[steps.instr == "clim_chamber"], builder)
+    _armxl(steps[steps.instr == "armxl"], builder)
+    _ac_source(steps[steps.instr == "ac_source"], builder)
+    events += _dc_source(steps[steps.instr == "dc_source"], builder)
+    traces = {name: Trace(to_datenum(t, base), v)
+              for name, (t, v) in builder.build(end).items()}
+    events = [(float(to_datenum(t, base)), text) for t, text in events]
+    return Timeline(traces, events, base, float(to_datenum(end, base)))
+
+
+_EMPTY = pd.DataFrame({c: np.empty(0) for c in ("t", "value", "ramp",
+                                                 "period")})
+
+
+class _Builder:
+    """Collect the setpoints of every signal, then build the traces"""
+
+    def __init__(self) -> None:
+        self._parts: dict[str, list[pd.DataFrame]] = {
+            name: [_EMPTY] for name in SIGNALS}
+
+    def add(self, name: str, t, value, ramp=None, period: float = 0):
+        """Add setpoints. 'ramp': number of intermediate values (NaN if not
+        a gradient), written every 'period' seconds"""
+        t = np.asarray(t, dtype=float)
+        part = pd.DataFrame({
+            "t": t,
+            "value": np.broadcast_to(np.asarray(value, dtype=float),
+                                     t.shape),
+            "ramp": np.broadcast_to(np.asarray(
+                np.nan if ramp is None else ramp, dtype=float), t.shape),
+            "period": float(period)})
+        self._parts.setdefault(name, []).append(part)
+
+    def build(self, end: float) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+        return {name: _expand(pd.concat(parts, ignore_index=True), end)
+                for name, parts in self._parts.items()}
+
+
+def _expand(points: pd.DataFrame, end: float
+            ) -> tuple[np.ndarray, np.ndarray]:
+    """Sort the setpoints, expand the gradients and close the trace"""
+    if points.empty:  # never set: not defined for all the sequence
+        return np.array([0.0, end]), np.full(2, np.nan)
+    points = points.sort_values("t", kind="stable", ignore_index=True)
+    t = points.t.to_numpy()
+    final = points.value.to_numpy()
+    start = points.value.shift().ffill().to_numpy()  # previous setpoint
+    n = points.ramp.to_numpy()
+    is_ramp = (n >= 1) & ~np.isnan(start)
+    n = np.where(is_ramp, n, 1).astype(np.int64)
+    # every setpoint -> n values, from start to final in n steps
+    source = np.repeat(np.arange(len(t)), n)
+    k = np.arange(len(source)) - np.repeat(np.cumsum(n) - n, n)
+    frac = np.where(is_ramp[source], (k + 1) / n[source], 1.0)
+    value = np.where(is_ramp[source],
+                     start[source] + (final - start)[source] * frac,
+                     final[source])
+    time_ = t[source] + k * points.period.to_numpy()[source]
+    # a new setpoint (or the end of the sequence) stops the gradient
+    next_t = np.append(t[1:], end)
+    keep = (k == 0) | (time_ < next_t[source])
+    time_, value = time_[keep], value[keep]
+    time_ = np.concatenate(([0.0], time_, [end]))
+    value = np.concatenate(([np.nan], value, value[-1:]))
+    return time_, value
+
+
+def _split_args(args: pd.Series, n: int) -> pd.DataFrame:
+    """First n space separated arguments as numbers (NaN if missing)"""
+    split = args.str.split(expand=True).reindex(columns=range(n))
+    return split.apply(pd.to_numeric, errors="coerce")
+
+
+def _is_on(args: pd.Series) -> np.ndarray:
+    return args.str.strip().str.lower().isin(ON_VALUES).to_numpy(float)
+
+
+def _chamber(steps: pd.DataFrame, builder: _Builder):
+    steps = steps[steps.cmd == "write_setpoint"]
+    kind = steps.arg.str.split().str[0]
+    values = _split_args(steps.arg.str.split(n=1).str[1].fillna(""), 2)
+    for meas, name in (("Temp", "clim_chamber.Temp"),
+                       ("Hum", "clim_chamber.Hum")):
+        mask = (kind == meas).to_numpy()
+        builder.add(name, steps.t[mask], values[0][mask], values[1][mask],
+                    CHAMBER_STEP)
+    # other setpoint: both not defined
+    other = (~kind.isin(("Temp", "Hum"))).to_numpy()
+    for name in ("clim_chamber.Temp", "clim_chamber.Hum"):
+        builder.add(name, steps.t[other], np.nan)
+
+
+def _armxl(steps: pd.DataFrame, builder: _Builder):
+    session = steps.cmd.str.endswith("charge_session.sh")
+    builder.add("armxl.State", steps.t[session],
+                steps.cmd[session].str.startswith("start").to_numpy(float))
+    steps = steps[~session]
+    values = _split_args(steps.arg, 2)
+    two = values[1].notna().to_numpy()  # voltage and power
+    power = (~two) & steps.cmd.str.endswith("power.sh").to_numpy()
+    voltage = (~two) & steps.cmd.str.endswith("voltage.sh").to_numpy()
+    reactive = (~two) & steps.cmd.str.endswith("reactive.sh").to_numpy()
+    builder.add("armxl.V", steps.t[two | voltage],
+                values[0][two | voltage] / 10)
+    builder.add("armxl.S", steps.t[two | power],
+                np.where(two, values[1], values[0])[two | power] / 10)
+    q = values[0][reactive].to_numpy()
+    builder.add("armxl.Q", steps.t[reactive],
+                np.where(q > 32000, (q - 32768) / -10, q / 10))
+
+
+def _ac_source(steps: pd.DataFrame, builder: _Builder):
+    output = (steps.cmd == "set_output").to_numpy()
+    builder.add("ac_source.State", steps.t[output], _is_on(steps.arg[output]))
+    first = _split_args(steps.arg, 1)[0].to_numpy()
+    for cmd, name in (("set_voltage", "ac_source.V"),
+                      ("set_frequency", "ac_source.F")):
+        mask = (steps.cmd == cmd).to_numpy()
+        builder.add(name, steps.t[mask], first[mask])
+    for cmd, voltage, frequency in (("europe_grid", 230, 50),
+                                    ("usa_grid", 277, 60)):
+        mask = (steps.cmd == cmd).to_numpy()
+        builder.add("ac_source.V", steps.t[mask], voltage)
+        builder.add("ac_source.F", steps.t[mask], frequency)
+
+
+def _dc_source(steps: pd.DataFrame, builder: _Builder
+               ) -> list[tuple[float, str]]:
+    output = (steps.cmd == "set_output").to_numpy()
+    builder.add("dc_source.State", steps.t[output], _is_on(steps.arg[output]))
+    values = _split_args(steps.arg, 2)
+    for cmd, name in (("set_voltage", "dc_source.Vhigh"),
+                      ("set_current", "dc_source.Ihigh")):
+        mask = (steps.cmd == cmd).to_numpy()
+        builder.add(name, steps.t[mask], values[0][mask],
+                    values[1][mask] / ITECH.TIMESTEP, ITECH.TIMESTEP)
+    for cmd, low, high in (("set_v_limit", "dc_source.Vlow",
+                            "dc_source.Vhigh"),
+                           ("set_c_limit", "dc_source.Ilow",
+                            "dc_source.Ihigh")):
+        mask = (steps.cmd == cmd).to_numpy()
+        builder.add(low, steps.t[mask], values[0][mask])
+        builder.add(high, steps.t[mask], values[1][mask])
+    # change of mode: setpoints of the previous mode not defined
+    function = steps[steps.cmd == "set_function"]
+    mode = function.arg.str.strip()
+    changed = function.t[1:]  # not the first one
+    for value, names in (("voltage", ("Vhigh", "Vlow", "Ihigh")),
+                         ("current", ("Vhigh", "Ihigh", "Ilow"))):
+        mask = (mode[1:] == value).to_numpy()
+        for name in names:
+            builder.add(f"dc_source.{name}", changed[mask], np.nan)
+    label = mode.map({"voltage": "CV mode", "current": "CC mode"})
+    return [(t, text) for t, text in zip(function.t, label)
+            if isinstance(text, str)]
@@ -0,0 +1,92 @@
+"""Step lines decimated to the visible x range at screen resolution"""
+import warnings
+
+import numpy as np
+from matplotlib.axes import Axes
+from matplotlib.lines import Line2D
+
+POINTS_PER_PIXEL = 2  # min/max pair of every pixel column
+FACTOR = 4  # raw points in a bin of the first level, bins in the next ones
+
+
+class MinMaxPyramid:
+    """Levels of min/max bins of a trace, each 'FACTOR' times coarser.
+
+    Level 0 is the raw trace; a bin of the next levels keeps the first x,
+    the min and the max of the values it covers, so a spike is never lost.
+    """
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, min_size: int = 1024
+                 ) -> None:
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.levels: list[tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        x, lo, hi = self.x, self.y, self.y
+        while len(x) > min_size:
+            x = x[::FACTOR]
+            lo = _reduce(lo, np.nanmin)
+            hi = _reduce(hi, np.nanmax)
+            self.levels.append((x, lo, hi))
+
+    def view(self, x0: float, x1: float, budget: int
+             ) -> tuple[np.ndarray, np.ndarray]:
+        """Points of the finest level with at most 'budget' points between
+        x0 and x1, plus the one before and after (lines reach the edges)"""
+        count = np.searchsorted(self.x, x1) - np.searchsorted(self.x, x0)
+        if count <= budget or not self.levels:
+            i0, i1 = _window(self.x, x0, x1)
+            return self.x[i0:i1], self.y[i0:i1]
+        for x, lo, hi in self.levels:
+            i0, i1 = _window(x, x0, x1)
+            if 2 * (i1 - i0) <= budget:
+                break
+        # every bin -> (x, min), (x, max); the last raw point closes it
+        xs = np.repeat(x[i0:i1], 2)
+        ys = np.column_stack((lo[i0:i1], hi[i0:i1])).ravel()
+        if i1 == len(x):
+            xs, ys = np.append(xs, self.x[-1]), np.append(ys, self.y[-1])
+        return xs, ys
+
+
+class DecimatedStep(Line2D):
+    """Step line ('where=post') decimated again at every draw, for the
+    current x limits and width of its axes (zoom, pan, resize, shared x)"""
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, budget: int = 4096,
+                 **kwargs) -> None:
+        self.pyramid = MinMaxPyramid(x, y)
+        super().__init__(*self.pyramid.view(-np.inf, np.inf, budget),
+                         drawstyle="steps-post", **kwargs)
+
+    def draw(self, renderer):
+        if self.axes is not None:
+            x0, x1 = sorted(self.axes.get_xlim())
+            budget = int(max(self.axes.bbox.width, 1) * POINTS_PER_PIXEL)
+            self.set_data(*self.pyramid.view(x0, x1, budget))
+        super().draw(renderer)
+
+
+def decimated_step(ax: Axes, x: np.ndarray, y: np.ndarray,
+                   **kwargs) -> DecimatedStep:
+    """Same as 'ax.step(x, y, where="post", **kwargs)' for long traces
+    (pass the color: the axes color cycle is not used)"""
+    budget = int(max(ax.bbox.width, 1) * POINTS_PER_PIXEL)
+    line = DecimatedStep(x, y, budget, **kwargs)
+    ax.add_line(line)
+    ax.autoscale_view()
+    return line
+
+
+def _reduce(values: np.ndarray, func) -> np.ndarray:
+    """'func' of every group of FACTOR values, NaN if all NaN"""
+    pad = -len(values) % FACTOR
+    values = np.append(values, np.full(pad, np.nan))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN bins
+        return func(values.reshape(-1, FACTOR), axis=1)
+
+
+def _window(x: np.ndarray, x0: float, x1: float) -> tuple[int, int]:
+    i0 = max(np.searchsorted(x, x0, side="right") - 1, 0)
+    i1 = min(np.searchsorted(x, x1, side="left") + 1, len(x))
+    return i0, i1